@@ -0,0 +1,209 @@
+from datetime import datetime
+
+import discord
+import numpy as np
+
+from functions import SECONDS, TIMES_TO_STR, get_seconds, new_to_old, old_to_new
+from store import CourseData, Steps
+
+## Array-based equivalents of functions.get_overview and functions.get_info.
+# Both take a store.CourseData, or the course's change points as a store.Steps, and build exactly
+# the same embeds and recommendations as the loop implementations, without visiting every
+# snapshot in Python.
+
+## Returns the index i of the first snapshot with seconds[i - 1] < t <= seconds[i], or -1 if t is
+# not inside the recorded range
+def pass_index(seconds: np.ndarray, t: float) -> int:
+    i = int(np.searchsorted(seconds, t, side='left'))
+    return i if 1 <= i < len(seconds) else -1
+
+## Returns the index of the first snapshot where the course goes from not full to full, or -1
+def capacity_index(enrolled: np.ndarray, total: np.ndarray) -> int:
+    crossings = (enrolled[:-1] != total[:-1]) & (enrolled[1:] == total[1:])
+    if not crossings.any():
+        return -1
+    return int(np.argmax(crossings)) + 1
+
+## Returns (maximum waitlist, students that joined, students that left) over the snapshots
+def waitlist_flow(waitlisted: np.ndarray) -> tuple[int, int, int]:
+    if len(waitlisted) < 2:
+        return 0, 0, 0
+    diff = np.diff(waitlisted.astype(np.int64))
+    return max(0, int(waitlisted[1:].max())), int(diff[diff > 0].sum()), int(-diff[diff < 0].sum())
+
+## Returns the snapshot indices at which each TIMES_TO_STR period is reached, in period order.
+# Mirrors get_info: a boundary only counts when it falls strictly between two snapshots, and a
+# period is only looked for after the previous one was found
+def period_indices(seconds: np.ndarray) -> list[int]:
+    indices = []
+    last = 0
+    for boundary in SECONDS[:len(TIMES_TO_STR)]:
+        i = int(np.searchsorted(seconds, boundary, side='left'))
+        if not (last < i < len(seconds) and seconds[i - 1] < boundary < seconds[i]):
+            break
+        indices.append(i)
+        last = i
+    return indices
+
+## Like period_indices, over change points: returns the runs at which each period is reached.
+# Every boundary starts a run (see store.to_steps), so the snapshot before that run is the last
+# one of the previous run
+def step_period_indices(steps: Steps) -> list[int]:
+    indices = []
+    last = 0
+    for boundary in SECONDS[:len(TIMES_TO_STR)]:
+        run = int(np.searchsorted(steps.start, boundary, side='left'))
+        if not (last < run < len(steps) and steps.end[run - 1] < boundary < steps.start[run]):
+            break
+        indices.append(run)
+        last = run
+    return indices
+
+## Returns the pass snapshots of get_overview from change points, as (key, row) or None.
+# Two pass times inside one run land on the same snapshot only if no snapshot lies between them;
+# that takes the snapshot times, which are looked up in seconds when given. Without them such
+# pass times count as different snapshots
+def step_passes(steps: Steps, times: list, seconds: np.ndarray | None = None) -> list:
+    states = [steps.state_at(t) for t in times]
+    keys = [None if state is None else (state[0], int(state[1])) for state in states]
+    if None not in states and keys[0] == keys[1] and states[0][1]:
+        if seconds is not None:
+            keys = [(state[0], 1, pass_index(seconds, t)) for state, t in zip(states, times)]
+        elif times[0] != times[1]:
+            keys = [(state[0], 1, t) for state, t in zip(states, times)]
+    return [None if state is None else (key, state[2]) for key, state in zip(keys, states)]
+
+def _row(data: CourseData | Steps, i: int) -> dict:
+    return {
+        'enrolled': int(data.enrolled[i]),
+        'waitlisted': int(data.waitlisted[i]),
+        'total': int(data.total[i])
+    }
+
+## Builds the overview embed and recommendations from precomputed facts.
+# passes: list of (snapshot index, snapshot) for the first and second pass, None if not in range
+# capacity_seconds: time the course first became full, None if it never did
+# Returns the same dictionary as functions.get_overview
+def build_overview(course: str, enrollment_times: tuple, passes: list, capacity_seconds) -> dict:
+    fptime, sptime = new_to_old(enrollment_times[0]), new_to_old(enrollment_times[1])
+    first, second = passes
+
+    rec = 0
+    wl_rec = 0
+
+    embed = discord.Embed(title=f'Enrollment Statistics for **{course}**')
+    wl_msg = ''
+
+    # both passes landing on the same snapshot only ever reports the first pass
+    if first is not None and second is not None and first[0] == second[0]:
+        second = None
+
+    fields = []
+    if first is not None:
+        fields.append((first[0], 'First Pass', first[1]))
+    if second is not None:
+        fields.append((second[0], 'Second Pass', second[1]))
+    for _, name, row in sorted(fields, key=lambda field: field[0]):
+        embed.add_field(name=name, value=f'Enrolled/Total: **{row["enrolled"]}/{row["total"]}**', inline=True)
+
+    if second is not None:
+        row = second[1]
+        if row['waitlisted'] > 0:
+            if row['waitlisted'] * 0.1 < row['total']:
+                wl_msg = 'It is **likely** to get in through waitlist, unless the class is a college writing program.'
+                wl_rec = 0
+            elif row['waitlisted'] * 0.15 < row['total']:
+                wl_msg = 'It is **possible** to get in through waitlist.'
+                wl_rec = 1
+            else:
+                wl_msg = 'It is **unlikely** to get in through waitlist.'
+                wl_rec = 2
+        else:
+            wl_rec = 3
+
+    if capacity_seconds is None:
+        embed.add_field(name='Capacity', value=f'Capacity is never reached. You can wait to second pass this course, but desired sections may be unavailable.\n{wl_msg}', inline=False)
+        rec = 3
+    else:
+        capacity_time = datetime.utcfromtimestamp(capacity_seconds)
+        # if capacity is reached after second pass enrollment time
+        if get_seconds(capacity_time) > sptime:
+            embed.add_field(name='Capacity', value=f'Expected to hit capacity after your second pass (on {datetime.utcfromtimestamp(old_to_new(get_seconds(capacity_time)))}).\nAt latest, you can second pass this course, but desired sections may be unavailable.', inline=False)
+            rec = 2
+        # if capacity is reached before second pass enrollment time but after first pass enrollment time
+        elif fptime < get_seconds(capacity_time) <= sptime:
+            embed.add_field(name='Capacity', value=f'Expected to hit capacity before your second pass (on {datetime.fromtimestamp(old_to_new(get_seconds(capacity_time)))}).\nYou can first pass this course, but you will likely have to waitlist the course in second pass.\n{wl_msg}', inline=False)
+            rec = 1
+        # if capacity is reached before first pass enrollment time
+        else:
+            embed.add_field(name='Capacity', value=f'Expected to hit capacity before your first pass (on {datetime.fromtimestamp(old_to_new(get_seconds(capacity_time)))}).\nYou may not be able to first pass this course.\n{wl_msg}', inline=False)
+            rec = 0
+
+    return {
+        'embed': embed,
+        'rec': rec,
+        'wl_rec': wl_rec
+    }
+
+## Summarizes data and returns an overview embed with additional recommendations
+# Same result as functions.get_overview, computed over the store arrays or change points
+# seconds: snapshot times, only used with change points (see step_passes)
+def get_overview(data: CourseData | Steps, course: str, enrollment_times: tuple, seconds: np.ndarray | None = None) -> dict:
+    times = [new_to_old(enrollment_times[0]), new_to_old(enrollment_times[1])]
+    if isinstance(data, Steps):
+        passes = step_passes(data, times, seconds)
+        data_seconds = data.start
+    else:
+        passes = []
+        for t in times:
+            i = pass_index(data.seconds, t)
+            passes.append(None if i < 0 else (i, _row(data, i)))
+        data_seconds = data.seconds
+
+    capacity = capacity_index(data.enrolled, data.total)
+    capacity_seconds = None if capacity < 0 else int(data_seconds[capacity])
+
+    return build_overview(course, enrollment_times, passes, capacity_seconds)
+
+## Marks important milestones as enrollment goes on and returns an embed with details
+# Same result as functions.get_info, computed over the store arrays or change points
+def get_info(data: CourseData | Steps, course: str, standing: int) -> discord.Embed:
+    if isinstance(data, Steps):
+        seconds = data.start
+        waitlisted = data.waitlisted
+        # the maximum skips the first snapshot, which is only the whole first run if that run has one snapshot
+        if len(data) and data.end[0] > data.start[0]:
+            waitlisted = np.concatenate((waitlisted[:1], waitlisted))
+        periods = step_period_indices(data)
+    else:
+        seconds = data.seconds
+        waitlisted = data.waitlisted
+        periods = period_indices(data.seconds)
+    max_waitlist, total_joined, total_off = waitlist_flow(waitlisted)
+
+    embed = discord.Embed(title=f'Enrollment Statistics for {course}')
+
+    prev_period_data = _row(data, 0)
+    for period, i in enumerate(periods):
+        curr_data = _row(data, i)
+        if period == standing + 1 or period == standing + 5:
+            embed.add_field(name=f'{TIMES_TO_STR[period-1]}', value=f'START | Enrolled: {prev_period_data["enrolled"]}/{prev_period_data["total"]}; Waitlisted: {prev_period_data["waitlisted"]}\nEND | Enrolled: {curr_data["enrolled"]}/{curr_data["total"]}; Waitlisted: {curr_data["waitlisted"]}', inline=False)
+        elif 8 <= period <= 10:
+            embed.add_field(name=f'{TIMES_TO_STR[period]}', value=f'Enrolled: {curr_data["enrolled"]}/{curr_data["total"]}; Waitlisted: {curr_data["waitlisted"]}', inline=False)
+        prev_period_data = curr_data
+
+    capacity = capacity_index(data.enrolled, data.total)
+    if capacity < 0:
+        embed.add_field(name = 'Capacity', value=f'Capacity never reached', inline=False)
+    else:
+        capacity_time = datetime.utcfromtimestamp(int(seconds[capacity]))
+        # number of periods already reached when the course filled up
+        period = int(np.searchsorted(periods, capacity, side='right'))
+        capacity_period = TIMES_TO_STR[period - 1]
+        embed.add_field(name='Capacity', value=f'Capacity reached at time {capacity_time} (**{capacity_period}**)', inline=False)
+
+    embed.add_field(name='Miscellaneous Statistics', value=f''' - Maximum number of waitlists: {max_waitlist}
+ - Approximate total number of students that joined the waitlist: {total_joined}
+ - Approximate total number of students off/left the waitlist: {total_off}''', inline=False)
+
+    return embed
@@ -0,0 +1,193 @@
+import argparse
+import functools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from analysis import capacity_index
+from store import CourseData, CourseStore, get_store
+from terms import Term, get_registry
+
+## Backtests the recommendations of get_overview against what actually happened.
+# Usage: python backtest.py [--predict WI23] [--observe WI24] [--step 60] [--workers 8] [--output report.json]
+# The bot predicts this term from the enrollment of an earlier one (the registry's data term), so
+# the backtest does the same: pass times on a grid over the observed term's enrollment period are
+# moved to the predicting term's schedule (Term.convert), recommended from its data exactly like
+# analysis.get_overview (for the whole grid at once with numpy), and compared against what then
+# happened in the observed term, for every course both terms have. Courses are split across a
+# process pool. The report has one confusion matrix per rule, with recommendations as rows and
+# outcomes as columns.
+# By default the data term predicts the next term with data. When a term is checked against its own
+# data, the pass rule always matches what followed (it is read off the same capacity crossing), so
+# only the waitlist rule is measured.
+
+# Labels of each rule's recommendations, indexed by rec / wl_rec
+REC_LABELS = ['Full before first pass', 'First pass only', 'Second pass', 'Anytime']
+WL_REC_LABELS = ['Likely', 'Possible', 'Unlikely', 'N/A', 'No data at second pass']
+# wl_rec of pass pairs whose second pass has no snapshot of its own to read the waitlist from
+NO_DATA = 4
+
+# Observed outcomes
+REC_OUTCOMES = ['Full at first pass', 'Full at second pass', 'Full when classes start', 'Open when classes start']
+WL_OUTCOMES = ['Got off waitlist', 'Stayed on waitlist', 'Seat open']
+
+## Returns every (first pass, second pass) pair with first <= second on a grid from a day before
+# a term's first pass to the end of its registration, step_minutes apart
+def pass_grid(boundaries: list[float], step_minutes: int) -> tuple[np.ndarray, np.ndarray]:
+    times = np.arange(boundaries[0] - 86400, boundaries[8], step_minutes * 60, dtype=np.float64)
+    first, second = np.triu_indices(len(times))
+    return times[first], times[second]
+
+## Returns get_overview's rec and wl_rec of one course for every pass pair, with NO_DATA as wl_rec
+# where get_overview has no second pass snapshot
+def recommend(data: CourseData, fp: np.ndarray, sp: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    seconds = np.asarray(data.seconds)
+    capacity = capacity_index(data.enrolled, data.total)
+    if capacity < 0:
+        rec = np.full(len(fp), 3)
+    else:
+        capacity_seconds = int(seconds[capacity])
+        rec = np.where(capacity_seconds > sp, 2, np.where(fp < capacity_seconds, 1, 0))
+
+    # same snapshots as analysis.pass_index; second pass only counts on a different snapshot
+    i_fp = np.searchsorted(seconds, fp, side='left')
+    i_sp = np.searchsorted(seconds, sp, side='left')
+    valid_fp = (i_fp >= 1) & (i_fp < len(seconds))
+    valid_sp = (i_sp >= 1) & (i_sp < len(seconds))
+    second = valid_sp & ~(valid_fp & (i_fp == i_sp))
+
+    row = np.clip(i_sp, 0, len(seconds) - 1)
+    waitlisted = np.asarray(data.waitlisted, dtype=np.float64)[row]
+    total = np.asarray(data.total, dtype=np.float64)[row]
+    wl_rec = np.where(waitlisted > 0, np.where(waitlisted * 0.1 < total, 0, np.where(waitlisted * 0.15 < total, 1, 2)), 3)
+    return rec, np.where(second, wl_rec, NO_DATA)
+
+## Returns what happened to a student of one course for every pass pair: the first of first pass,
+# second pass and classes starting (boundaries[9]) at which the course was full (rec outcome), and
+# whether joining the waitlist at second pass got them a seat by the end of the data (wl_rec outcome)
+def observe(data: CourseData, fp: np.ndarray, sp: np.ndarray, boundaries: list[float]) -> tuple[np.ndarray, np.ndarray]:
+    seconds = np.asarray(data.seconds)
+    enrolled = np.asarray(data.enrolled)
+    total = np.asarray(data.total)
+    waitlisted = np.asarray(data.waitlisted, dtype=np.int64)
+
+    ## Returns the last snapshot at or before each t, -1 before the first one
+    def latest(t):
+        return np.searchsorted(seconds, t, side='right') - 1
+
+    def full(t):
+        i = latest(t)
+        return (i >= 0) & (enrolled[np.maximum(i, 0)] >= total[np.maximum(i, 0)])
+
+    full_fp, full_sp = full(fp), full(sp)
+    full_start = full(np.array([boundaries[9]]))[0]
+    rec = np.where(full_fp, 0, np.where(full_sp, 1, 2 if full_start else 3))
+
+    # students that left the waitlist after each snapshot, until the end of the data
+    left = np.concatenate(([0], np.cumsum(np.maximum(-np.diff(waitlisted), 0))))
+    i = latest(sp)
+    position = waitlisted[np.maximum(i, 0)] + 1
+    cleared = left[-1] - left[np.maximum(i, 0)] >= position
+    wl = np.where(full_sp, np.where(cleared, 0, 1), 2)
+    return rec, wl
+
+## Returns a zero confusion matrix for each of the given rules ('rec', 'wl_rec')
+def empty_matrices(rules: tuple = ('rec', 'wl_rec')) -> dict:
+    shapes = {'rec': (len(REC_LABELS), len(REC_OUTCOMES)), 'wl_rec': (len(WL_REC_LABELS), len(WL_OUTCOMES))}
+    return {rule: np.zeros(shapes[rule], dtype=np.int64) for rule in rules}
+
+## Returns the rules a backtest of one term by another measures
+def measured_rules(predict: Term, observed: Term) -> tuple:
+    return ('wl_rec',) if predict is observed else ('rec', 'wl_rec')
+
+## Adds up the confusion matrices of a chunk of courses. Runs in a worker process
+# shift: seconds added to an observed term's time to move it to the predicting term's schedule
+def evaluate(predict_dir: str, observe_dir: str, courses: list[str], boundaries: list[float], shift: float,
+             step_minutes: int, rules: tuple) -> dict:
+    predict_store, observe_store = CourseStore(predict_dir), CourseStore(observe_dir)
+    fp, sp = pass_grid(boundaries, step_minutes)
+    matrices = empty_matrices(rules)
+    for course in courses:
+        history, outcome = predict_store.get(course), observe_store.get(course)
+        if len(history) == 0 or len(outcome) == 0:
+            continue
+        predicted = dict(zip(('rec', 'wl_rec'), recommend(history, fp + shift, sp + shift)))
+        observed = dict(zip(('rec', 'wl_rec'), observe(outcome, fp, sp, boundaries)))
+        for rule in rules:
+            np.add.at(matrices[rule], (predicted[rule], observed[rule]), 1)
+    return {rule: matrix.tolist() for rule, matrix in matrices.items()}
+
+## Returns the term the data term predicts in a backtest: the next term with data after it, or the
+# data term itself if there is none
+def default_observed() -> Term:
+    registry = get_registry()
+    later = [term for term in registry.with_data() if term.seconds[0] > registry.data_term.seconds[0]]
+    return later[0] if later else registry.data_term
+
+## Runs evaluate on a process pool over every course that both terms have, predicting one term
+# (default: the next term with data) with another's data (default: the data term)
+# Returns {rule: confusion matrix}, without 'rec' when a term is checked against itself
+def backtest(predict: str | None = None, observe: str | None = None, step_minutes: int = 60,
+             workers: int | None = None) -> dict:
+    registry = get_registry()
+    predict = registry.get(predict) if predict else registry.data_term
+    observed = registry.get(observe) if observe else default_observed()
+    for term in (predict, observed):
+        if not term.has_data():
+            raise ValueError(f'Term {term.key} has no enrollment data to backtest with')
+    # opening the stores ingests the terms' csv files if needed
+    observed_courses = set(get_store(observed.key).courses())
+    courses = [course for course in get_store(predict.key).courses() if course in observed_courses]
+    rules = measured_rules(predict, observed)
+    workers = workers or os.cpu_count()
+    # a few chunks per worker keeps them busy when course sizes differ
+    chunks = [chunk for chunk in (courses[i::workers * 4] for i in range(workers * 4)) if chunk]
+    # an empty store still reports (all zero) matrices
+    totals = empty_matrices(rules)
+    run_chunk = functools.partial(evaluate, predict.store_dir, observed.store_dir, boundaries=observed.seconds.tolist(),
+                                  shift=float(observed.convert(0, predict)), step_minutes=step_minutes, rules=rules)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(run_chunk, chunks):
+            for rule, matrix in result.items():
+                totals[rule] += matrix
+    return {rule: matrix.tolist() for rule, matrix in totals.items()}
+
+## Formats a confusion matrix with the share of each outcome per recommendation
+def format_matrix(title: str, matrix: list, labels: list[str], outcomes: list[str]) -> str:
+    width = max(map(len, labels)) + 2
+    lines = [title, ' ' * width + ''.join(f'{outcome:>25}' for outcome in outcomes) + f'{"Total":>12}']
+    for label, row in zip(labels, matrix):
+        count = sum(row)
+        cells = ''.join(f'{value:>16} ({100 * value / count if count else 0:5.1f}%)' for value in row)
+        lines.append(f'{label:<{width}}{cells}{count:>12}')
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='Backtest the /query recommendations against observed enrollment.')
+    parser.add_argument('--predict', help='term whose data makes the recommendations (default: the data term)')
+    parser.add_argument('--observe', help='term the recommendations are checked against (default: the next term with data)')
+    parser.add_argument('--step', type=int, default=60, help='minutes between pass times on the grid')
+    parser.add_argument('--workers', type=int, help='worker processes (default: number of cpus)')
+    parser.add_argument('--output', help='also write the matrices as JSON here')
+    args = parser.parse_args()
+
+    predict = get_registry().get(args.predict) if args.predict else get_registry().data_term
+    observed = get_registry().get(args.observe) if args.observe else default_observed()
+    print(f'Predicting {observed.name} with the data of {predict.name}')
+    print()
+    matrices = backtest(predict.key, observed.key, args.step, args.workers)
+    if 'rec' in matrices:
+        print(format_matrix('Pass recommendation (rec)', matrices['rec'], REC_LABELS, REC_OUTCOMES))
+    else:
+        print('Pass recommendation (rec): not measured, the term is checked against its own data')
+    print()
+    print(format_matrix('Waitlist recommendation (wl_rec)', matrices['wl_rec'], WL_REC_LABELS, WL_OUTCOMES))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'predict': predict.key, 'observe': observed.key, 'step_minutes': args.step, 'rec_labels': REC_LABELS, 'rec_outcomes': REC_OUTCOMES,
+                       'wl_rec_labels': WL_REC_LABELS, 'wl_outcomes': WL_OUTCOMES, 'matrices': matrices}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
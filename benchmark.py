@@ -0,0 +1,270 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import types
+from datetime import timedelta
+
+import discord
+import numpy as np
+
+import functions
+from functions import SECONDS, SECONDS_NEW
+
+## Benchmark suite for the /query pipeline, run against synthetic enrollment data.
+# Usage: python benchmark.py [--courses 5 50] [--intervals 60 15] [--repeat 5] [--output results.json]
+# Every combination of course count and snapshot interval gets its own temporary data directory
+# laid out like production (csv/, store/, cache/ next to the working directory), and the timings
+# are written as JSON so runs of different versions can be compared.
+
+DEPARTMENTS = ['CSE', 'ECE', 'MATH', 'BILD', 'COGS', 'PHYS', 'CHEM', 'MAE', 'DSC', 'POLI']
+CAPACITIES = [30, 60, 100, 150, 200, 300]
+
+## Returns n distinct synthetic course names such as "CSE 12A"
+def course_names(n: int, rng: random.Random) -> list[str]:
+    names = set()
+    while len(names) < n:
+        suffix = rng.choice(['', '', '', 'A', 'B', 'C', 'L'])
+        names.add(f'{rng.choice(DEPARTMENTS)} {rng.randint(1, 199)}{suffix}')
+    return sorted(names)
+
+## Simulates one course's enrollment, one snapshot every interval_minutes from a week before the
+# first pass to the enrollment deadline. Demand arrives in bursts when each pass window opens and
+# trickles in between; students beyond capacity join the waitlist from second pass on, and the
+# waitlist drains once classes begin.
+# Returns (seconds, enrolled, available, waitlisted, total) arrays
+def simulate_course(interval_minutes: int, rng: np.random.Generator) -> tuple:
+    start, end = SECONDS[0] - 7 * 86400, SECONDS[10]
+    seconds = np.arange(start, end, interval_minutes * 60, dtype=np.int64)
+    total = int(rng.choice(CAPACITIES))
+    # popular courses have several times more demand than seats
+    demand = total * rng.uniform(0.4, 2.5)
+
+    arrivals = np.zeros(len(seconds))
+    shares = rng.dirichlet(np.ones(8) * 2) * 0.9
+    for share, window in zip(shares, SECONDS[:8]):
+        # most of a window's demand shows up within hours of it opening
+        after = seconds - window
+        burst = np.where(after >= 0, 1 - np.exp(-np.maximum(after, 0) / rng.uniform(1800, 14400)), 0)
+        arrivals += share * demand * burst
+    arrivals += 0.1 * demand * np.clip((seconds - start) / (end - start), 0, 1)
+    wanted = np.floor(arrivals).astype(np.int64)
+
+    # a few students drop the course along the way
+    drops = np.cumsum(rng.random(len(seconds)) < 0.002)
+    enrolled = np.minimum(total, np.maximum(wanted - drops, 0))
+
+    overflow = np.maximum(wanted - drops - total, 0)
+    overflow[seconds < SECONDS[4]] = 0
+    # waitlisted students are let in or give up once classes begin
+    drain = np.clip((seconds - SECONDS[9]) / (SECONDS[10] - SECONDS[9]), 0, 1)
+    waitlisted = np.floor(overflow * (1 - drain)).astype(np.int64)
+
+    return seconds, enrolled, total - enrolled, waitlisted, np.full(len(seconds), total)
+
+## Writes courses synthetic csv files into directory in the format readcsv expects
+# Returns the course names
+def generate(directory: str, courses: int, interval_minutes: int, seed: int = 0) -> list[str]:
+    os.makedirs(directory, exist_ok=True)
+    names = course_names(courses, random.Random(seed))
+    rng = np.random.default_rng(seed)
+    for course in names:
+        columns = simulate_course(interval_minutes, rng)
+        with open(os.path.join(directory, f'{course}.csv'), 'w', newline='') as f:
+            f.write('time,enrolled,available,waitlisted,total\n')
+            for second, enrolled, available, waitlisted, total in zip(*(column.tolist() for column in columns)):
+                date = functions.EPOCH + timedelta(seconds=second)
+                f.write(f'|{date:%Y-%m-%d %H:%M:%S}|,{enrolled},{available},{waitlisted},{total}\n')
+    return names
+
+## Returns min/median/mean/max of a list of durations, in milliseconds
+def summarize(samples: list[float]) -> dict:
+    return {
+        'runs': len(samples),
+        'min_ms': min(samples) * 1000,
+        'median_ms': statistics.median(samples) * 1000,
+        'mean_ms': statistics.mean(samples) * 1000,
+        'max_ms': max(samples) * 1000
+    }
+
+## Times fn over every course, repeat times. Returns per-call statistics
+def time_per_course(fn, courses: list, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        for course in courses:
+            began = time.perf_counter()
+            fn(course)
+            samples.append(time.perf_counter() - began)
+    return summarize(samples)
+
+## A discord.Interaction stand-in that accepts every response without a network connection
+class StubInteraction(discord.Interaction):
+    def __init__(self):
+        message = types.SimpleNamespace(id=0, flags=types.SimpleNamespace(ephemeral=False))
+        async def fetch_message(_):
+            return message
+        async def send(*args, **kwargs):
+            return message
+        async def defer(*args, **kwargs):
+            pass
+        message.channel = types.SimpleNamespace(fetch_message=fetch_message)
+        self._state = None
+        self.user = None
+        self.stub_response = types.SimpleNamespace(is_done=lambda: True, defer=defer, send_message=send)
+        self.stub_followup = types.SimpleNamespace(send=send)
+
+    @property
+    def response(self):
+        return self.stub_response
+
+    @property
+    def followup(self):
+        return self.stub_followup
+
+## Times encoding the same rendered charts in each chart format, without a byte budget
+# Returns {'encode_<format>': per-chart timings, with the mean encoded size in bytes}
+def encode_formats(backgrounds: list, fp_time: int, sp_time: int, repeat: int) -> dict:
+    import encoding
+    from PIL import Image, features
+    images = []
+    for background in backgrounds:
+        background.render(fp_time, sp_time)
+        images.append(Image.frombuffer('RGBA', background.canvas.get_width_height(), background.canvas.buffer_rgba(),
+                                       'raw', 'RGBA', 0, 1).convert('RGB'))
+    timings = {}
+    for format in encoding.FORMATS:
+        if format == 'webp' and not features.check('webp'):
+            continue
+        settings = encoding.Encoding(format)
+        sizes = [len(encoding.save(image, format, settings)) for image in images]
+        timings[f'encode_{format}'] = time_per_course(lambda image: encoding.save(image, format, settings), images, repeat)
+        timings[f'encode_{format}']['mean_bytes'] = statistics.mean(sizes)
+    return timings
+
+## Resets the process-wide singletons so the next benchmark case reads its own data directory
+def reset_modules():
+    import catalog, store, summary, warmup
+    store._stores.clear()
+    summary._indexes.clear()
+    warmup._loading = None
+    catalog._catalog = None
+
+## Runs every benchmark for one data configuration inside workdir
+def run_case(workdir: str, courses: int, interval_minutes: int, repeat: int, executor: str) -> dict:
+    import analysis, charts, modal, paginator, store, summary
+
+    names = generate(os.path.join(workdir, 'csv'), courses, interval_minutes)
+    os.makedirs(os.path.join(workdir, 'bot'))
+    os.chdir(os.path.join(workdir, 'bot'))
+    reset_modules()
+
+    timings = {}
+    csv_path = lambda course: f'../csv/{course}.csv'
+
+    began = time.perf_counter()
+    store.ingest()
+    timings['ingest'] = summarize([time.perf_counter() - began])
+    began = time.perf_counter()
+    course_store = store.get_store()
+    index = summary.get_summary_index()
+    timings['summary_build'] = summarize([time.perf_counter() - began])
+
+    records = {course: functions.readcsv(csv_path(course)) for course in names}
+    times = (SECONDS_NEW[2] + 3600, SECONDS_NEW[6] + 3600)
+    timings['readcsv'] = time_per_course(lambda c: functions.readcsv(csv_path(c)), names, repeat)
+    timings['get_overview_loop'] = time_per_course(lambda c: functions.get_overview(records[c], c, times), names, repeat)
+    timings['get_overview_array'] = time_per_course(lambda c: analysis.get_overview(course_store.get(c), c, times), names, repeat)
+    timings['get_overview_summary'] = time_per_course(lambda c: index.overview(c, times), names, repeat)
+    timings['get_info_loop'] = time_per_course(lambda c: functions.get_info(records[c], c, 1), names, repeat)
+    timings['get_info_array'] = time_per_course(lambda c: analysis.get_info(course_store.get(c), c, 1), names, repeat)
+    plotted = names[:min(len(names), 5)]
+    # charts draw the pass times where they fall in the data term
+    lines = charts.pass_lines(*times)
+    timings['plot_enrollment'] = time_per_course(lambda c: functions.plot_enrollment(course_store.get(c), c, *lines), plotted, 1)
+    # build each course background once so the timing covers only the per-request work
+    time_per_course(lambda c: charts.render_enrollment(c, course_store.version_of(c), *lines), plotted, 1)
+    timings['render_background_reuse'] = time_per_course(lambda c: charts.render_enrollment(c, course_store.version_of(c), *lines), plotted, repeat)
+    timings.update(encode_formats([charts._get_background(c, course_store.version_of(c)) for c in plotted],
+                                  *lines, repeat))
+
+    async def overview(classes):
+        query = modal.OverviewInputModal(None, title='Input Details')
+        await query.overview(StubInteraction(), classes, *times)
+
+    async def run_overviews():
+        charts.configure({'render_executor': executor, 'chart_cache_dir': '../cache/charts'})
+        results = {}
+        for label in ('overview_cold', 'overview_warm'):
+            samples = []
+            for _ in range(1 if label == 'overview_cold' else repeat):
+                began = time.perf_counter()
+                await overview(names[:10])
+                samples.append(time.perf_counter() - began)
+            results[label] = summarize(samples)
+        charts.get_executor().shutdown()
+        return results
+
+    # the paginator refreshes its buttons a second after pages arrive; leave that out of the timings
+    paginator.REFRESH_DELAY = 0
+    timings.update(asyncio.run(run_overviews()))
+
+    return {
+        'courses': courses,
+        'interval_minutes': interval_minutes,
+        'snapshots_per_course': len(records[names[0]]),
+        'timings': timings
+    }
+
+def metadata(executor: str) -> dict:
+    import matplotlib
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'matplotlib': matplotlib.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'executor': executor
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the /query pipeline on synthetic enrollment data.')
+    parser.add_argument('--courses', type=int, nargs='+', default=[5, 50], help='course counts to generate')
+    parser.add_argument('--intervals', type=int, nargs='+', default=[60, 15], help='minutes between snapshots')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement')
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread', help='chart render pool')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    results = []
+    cwd = os.getcwd()
+    for courses in args.courses:
+        for interval in args.intervals:
+            workdir = tempfile.mkdtemp(prefix='enrollment-bench-')
+            try:
+                results.append(run_case(workdir, courses, interval, args.repeat, args.executor))
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    report = json.dumps({'meta': metadata(args.executor), 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
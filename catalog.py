@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from collections import defaultdict
+
+from store import CSV_DIR
+
+## In-memory catalog of the offered courses, used to resolve what users type into course names.
+# Names are looked up by a normalized key (uppercase, no spaces) in a hash map. Inputs that do not
+# match get "did you mean" suggestions from a prefix trie (CSE12 -> CSE 12A, CSE 12B) and a
+# trigram index for typos (CES 12 -> CSE 12).
+
+MAX_SUGGESTIONS = 3
+# Minimum trigram similarity for a typo suggestion
+MIN_SIMILARITY = 0.2
+# How often, in seconds, the data directory is checked for added or removed courses
+REFRESH_INTERVAL = 30
+
+## Returns the lookup key of a course name or user input
+def normalize(name: str) -> str:
+    return name.replace(' ', '').upper()
+
+def _trigrams(key: str) -> set[str]:
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class Catalog:
+    def __init__(self, directory: str = CSV_DIR):
+        self.directory = directory
+        self.mtime = None
+        self.checked = 0
+        self.names = {}
+        self.trie = {}
+        self.trigrams = defaultdict(set)
+        self.refresh()
+
+    ## Rebuilds the indexes if the data directory changed since the last build
+    def refresh(self):
+        self.checked = time.monotonic()
+        mtime = os.stat(self.directory).st_mtime_ns
+        if mtime == self.mtime:
+            return
+        names = {}
+        trie = {}
+        trigrams = defaultdict(set)
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.csv'):
+                continue
+            course = entry.name[:-4]
+            key = normalize(course)
+            names[key] = course
+            node = trie
+            for char in key:
+                node = node.setdefault(char, {})
+            node[''] = course
+            for trigram in _trigrams(key):
+                trigrams[trigram].add(key)
+        # swap in the finished indexes so lookups never see a half-built catalog
+        self.names, self.trie, self.trigrams, self.mtime = names, trie, trigrams, mtime
+
+    def _refresh_if_due(self):
+        if time.monotonic() - self.checked >= REFRESH_INTERVAL:
+            self.refresh()
+
+    def __contains__(self, course: str) -> bool:
+        return normalize(course) in self.names
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    ## Returns the version of the catalog (the data directory's modification time), after
+    # picking up any added or removed courses
+    def version(self) -> int:
+        self._refresh_if_due()
+        return self.mtime
+
+    ## Returns up to limit course names starting with the given key, in alphabetical order
+    def complete(self, key: str, limit: int = MAX_SUGGESTIONS) -> list[str]:
+        node = self.trie
+        for char in key:
+            if char not in node:
+                return []
+            node = node[char]
+        results = []
+        stack = [node]
+        while stack and len(results) < limit:
+            node = stack.pop()
+            if '' in node:
+                results.append(node[''])
+            stack.extend(node[char] for char in sorted((c for c in node if c), reverse=True))
+        return results
+
+    ## Returns up to limit course names similar to the given key, most similar first
+    def similar(self, key: str, limit: int = MAX_SUGGESTIONS) -> list[str]:
+        grams = _trigrams(key)
+        shared = defaultdict(int)
+        for trigram in grams:
+            for candidate in self.trigrams.get(trigram, ()):
+                shared[candidate] += 1
+        scored = []
+        for candidate, count in shared.items():
+            similarity = count / (len(grams) + len(_trigrams(candidate)) - count)
+            if similarity >= MIN_SIMILARITY:
+                scored.append((-similarity, candidate))
+        return [self.names[candidate] for _, candidate in sorted(scored)[:limit]]
+
+    ## Resolves user input to a course name
+    # Returns (course, suggestions): the course name or None, and "did you mean" names if it was not found
+    def resolve(self, text: str) -> tuple[str | None, list[str]]:
+        self._refresh_if_due()
+        key = normalize(text)
+        if key in self.names:
+            return self.names[key], []
+        suggestions = self.complete(key)
+        for course in self.similar(key):
+            if len(suggestions) >= MAX_SUGGESTIONS:
+                break
+            if course not in suggestions:
+                suggestions.append(course)
+        return None, suggestions
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+## Returns the process-wide catalog, built from the data directory on first use
+def get_catalog() -> Catalog:
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = Catalog(CSV_DIR)
+    return _catalog
@@ -0,0 +1,437 @@
+import asyncio
+import functools
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+import encoding
+from encoding import Encoded, Encoding
+from functions import fill_percentage, new_to_old, plot_background, plot_comparison_background
+from scheduler import FairLimiter, SingleFlight
+from store import get_store
+from summary import get_summary_index
+from terms import get_registry
+import tracing
+
+## Runs chart rendering on a worker pool so matplotlib never blocks the event loop, and caches
+# the encoded images (see encoding.py for the formats and their config keys). Configured with the
+# optional config keys
+#   render_executor: 'process' | 'thread' (default 'process')
+#   render_workers: int                   (default: number of cpus)
+#   chart_cache_dir: str                  (default '../cache/charts')
+#   chart_cache_memory_bytes: int         (default 64 MiB)
+#   chart_cache_disk_bytes: int           (default 512 MiB)
+#   chart_backgrounds: int                (per worker, default 32)
+#   render_concurrency: int               (charts rendering at once, default: render_workers)
+#   render_concurrency_per_user: int      (of those, at most this many for one user, default 2)
+
+DEFAULT_EXECUTOR = 'process'
+CACHE_DIR = '../cache/charts'
+CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+CACHE_DISK_BYTES = 512 * 1024 * 1024
+# Chart requests per course are saved next to the cached charts every this many requests
+POPULARITY_SAVE_INTERVAL = 100
+POPULARITY_FILE = 'popular.json'
+BACKGROUNDS = 32
+CONCURRENCY_PER_USER = 2
+
+# Pass times are rounded to this many seconds before rendering and caching; at 80 dpi one pixel of
+# the enrollment window already spans most of an hour
+PASS_TIME_RESOLUTION = 900
+
+# Charts are rendered at the same resolution and padding as savefig(dpi=80, bbox_inches='tight')
+DPI = 80
+PAD_INCHES = 0.1
+
+## Size-bounded LRU cache of encoded chart bytes, kept in memory with an on-disk second level
+class ChartCache:
+    def __init__(self, directory: str = CACHE_DIR, memory_bytes: int = CACHE_MEMORY_BYTES, disk_bytes: int = CACHE_DISK_BYTES):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        # key -> file size, least recently used first
+        self.disk = OrderedDict()
+        self.disk_size = 0
+        # course -> keys cached by this process, for invalidation
+        self.keys = {}
+        # course -> charts requested, kept across restarts to know what to warm up
+        self.requests = Counter()
+        self.unsaved = 0
+
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.png'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_size += size
+        try:
+            with open(os.path.join(directory, POPULARITY_FILE)) as f:
+                self.requests.update(json.load(f))
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.png')
+
+    ## Returns the cached image bytes for key, or None
+    def get(self, key: str) -> bytes | None:
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        if key in self.disk:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    image = f.read()
+            except FileNotFoundError:
+                self.disk_size -= self.disk.pop(key)
+                return None
+            # touch the file so the next startup keeps the recency order
+            os.utime(self._path(key))
+            self.disk.move_to_end(key)
+            self._put_memory(key, image)
+            return image
+        return None
+
+    ## Caches image under key. courses are the courses charted, whose new snapshots invalidate it
+    def put(self, key: str, image: bytes, *courses: str):
+        for course in courses:
+            self.keys.setdefault(course, set()).add(key)
+        self._put_memory(key, image)
+        if key not in self.disk:
+            path = self._path(key)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(image)
+            os.replace(path + '.tmp', path)
+            self.disk[key] = len(image)
+            self.disk_size += len(image)
+        while self.disk_size > self.disk_bytes and len(self.disk) > 1:
+            old_key, size = self.disk.popitem(last=False)
+            self.disk_size -= size
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+    ## Counts a chart request for course
+    def record(self, course: str):
+        self.requests[course] += 1
+        self.unsaved += 1
+        if self.unsaved >= POPULARITY_SAVE_INTERVAL:
+            self.save_requests()
+
+    def save_requests(self):
+        path = os.path.join(self.directory, POPULARITY_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.requests, f)
+        os.replace(path + '.tmp', path)
+        self.unsaved = 0
+
+    ## Returns the n most requested courses, most requested first
+    def popular(self, n: int) -> list[str]:
+        return [course for course, _ in self.requests.most_common(n)]
+
+    ## Drops every chart of a course cached since startup, in memory and on disk
+    def invalidate(self, course: str):
+        for key in self.keys.pop(course, ()):
+            if key in self.memory:
+                self.memory_size -= len(self.memory.pop(key))
+            if key in self.disk:
+                self.disk_size -= self.disk.pop(key)
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+
+    def _put_memory(self, key: str, image: bytes):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+        self.memory[key] = image
+        self.memory_size += len(image)
+        while self.memory_size > self.memory_bytes and len(self.memory) > 1:
+            _, old = self.memory.popitem(last=False)
+            self.memory_size -= len(old)
+
+## A course chart with everything but the pass-time lines already rasterized.
+# The figure is resized to its tight bounding box up front, so each render only restores the
+# saved pixels, draws the two lines on top and encodes the result within a byte budget.
+class Background:
+    def __init__(self, data, course: str):
+        self._prepare(*plot_background(data, course, dpi=DPI))
+
+    def _prepare(self, fig, ax, y_lim: float):
+        self.lock = threading.Lock()
+        self.fig, self.ax, self.y_lim = fig, ax, y_lim
+        self._fit_tight()
+        self.lines = self.ax.vlines(x=[0, 0], ymin=0, ymax=self.y_lim, colors='black', label='Enrollment Time', animated=True)
+        self.canvas = self.fig.canvas
+        self.canvas.draw()
+        self.pixels = self.canvas.copy_from_bbox(self.fig.bbox)
+
+    ## Same crop as savefig(bbox_inches='tight'), applied to the figure itself
+    def _fit_tight(self):
+        bbox = self.fig.get_tightbbox(self.fig.canvas.get_renderer()).padded(PAD_INCHES)
+        width, height = self.fig.get_size_inches()
+        for ax in self.fig.axes:
+            x0, y0, w, h = ax.get_position().bounds
+            ax.set_position([(x0 * width - bbox.x0) / bbox.width, (y0 * height - bbox.y0) / bbox.height,
+                             w * width / bbox.width, h * height / bbox.height])
+        self.fig.set_size_inches(bbox.width, bbox.height)
+
+    def _draw_pass_times(self, fp_time: int, sp_time: int):
+        self.lines.set_segments([[(fp_time, 0), (fp_time, self.y_lim)], [(sp_time, 0), (sp_time, self.y_lim)]])
+        self.ax.draw_artist(self.lines)
+
+    def _encode(self, budget: int | None) -> Encoded:
+        from PIL import Image
+        image = Image.frombuffer('RGBA', self.canvas.get_width_height(), self.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+        return encoding.encode(image, _encoding, budget)
+
+    ## Returns the chart with pass-time lines at fp_time and sp_time, encoded within budget bytes
+    def render(self, fp_time: int, sp_time: int, budget: int | None = None) -> Encoded:
+        with self.lock:
+            self.canvas.restore_region(self.pixels)
+            self._draw_pass_times(fp_time, sp_time)
+            return self._encode(budget)
+
+## The axes and pass rectangles of a comparison chart. They do not depend on the courses, so one
+# is rasterized per worker and every comparison only draws its courses' lines on top
+class ComparisonBackground(Background):
+    def __init__(self):
+        self._prepare(*plot_comparison_background(dpi=DPI))
+
+    ## Returns the chart with one line per (course, seconds, percentages) in series, and pass-time
+    # lines if fp_time and sp_time are given, encoded within budget bytes
+    def render(self, series: list, fp_time: int | None = None, sp_time: int | None = None, budget: int | None = None) -> Encoded:
+        with self.lock:
+            self.canvas.restore_region(self.pixels)
+            lines = [self.ax.plot(seconds, percentages, color=f'C{i}', label=course, animated=True)[0]
+                     for i, (course, seconds, percentages) in enumerate(series)]
+            legend = self.ax.legend(handles=lines, loc='upper left', fontsize=8)
+            legend.set_animated(True)
+            try:
+                for line in lines:
+                    self.ax.draw_artist(line)
+                if fp_time is not None and sp_time is not None:
+                    self._draw_pass_times(fp_time, sp_time)
+                self.ax.draw_artist(legend)
+                return self._encode(budget)
+            finally:
+                legend.remove()
+                for line in lines:
+                    line.remove()
+
+_executor = None
+_workers = 1
+_cache = None
+# identical concurrent renders share one flight; misses are admitted fairly between users
+_flights = SingleFlight()
+_limiter = None
+
+# Per-worker backgrounds, keyed by (course, data version)
+_backgrounds = OrderedDict()
+_backgrounds_limit = BACKGROUNDS
+_backgrounds_lock = threading.Lock()
+_comparison = None
+# set in each worker by configure
+_encoding = Encoding()
+
+## Creates the render pool and chart cache from the bot config. Safe to call once at startup
+def configure(config: dict) -> Executor:
+    global _executor, _workers, _cache, _limiter, _encoding
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    kind = config.get('render_executor', DEFAULT_EXECUTOR)
+    workers = config.get('render_workers', os.cpu_count())
+    _workers = workers or 1
+    backgrounds = config.get('chart_backgrounds', BACKGROUNDS)
+    _encoding = encoding.from_config(config)
+    if kind == 'thread':
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render',
+                                       initializer=_init_worker, initargs=(backgrounds, _encoding))
+    elif kind == 'process':
+        # spawn instead of fork: the parent holds the gateway connection and its threads
+        _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_init_worker, initargs=(backgrounds, _encoding))
+    else:
+        raise ValueError(f'Unknown render_executor {kind!r}, expected "process" or "thread"')
+    _cache = ChartCache(config.get('chart_cache_dir', CACHE_DIR),
+                        config.get('chart_cache_memory_bytes', CACHE_MEMORY_BYTES),
+                        config.get('chart_cache_disk_bytes', CACHE_DISK_BYTES))
+    _limiter = FairLimiter(config.get('render_concurrency', workers or 1),
+                           config.get('render_concurrency_per_user', CONCURRENCY_PER_USER))
+    return _executor
+
+def _init_worker(backgrounds: int, chart_encoding: Encoding):
+    global _backgrounds_limit, _encoding
+    _backgrounds_limit = backgrounds
+    _encoding = chart_encoding
+
+def get_executor() -> Executor:
+    if _executor is None:
+        configure({})
+    return _executor
+
+def get_cache() -> ChartCache:
+    if _cache is None:
+        configure({})
+    return _cache
+
+def get_limiter() -> FairLimiter:
+    if _limiter is None:
+        configure({})
+    return _limiter
+
+## Returns a user's pass times (current term) at the matching points of the data term, where
+# charts, which show the data term's enrollment, draw them
+def pass_lines(fp_time: int, sp_time: int) -> tuple[int, int]:
+    return new_to_old(fp_time), new_to_old(sp_time)
+
+## Rounds a pass time to the chart resolution
+def round_pass_time(t: int) -> int:
+    return int(round(t / PASS_TIME_RESOLUTION) * PASS_TIME_RESOLUTION)
+
+## Returns the cache key of a chart encoded as described by encoded (Encoding.key)
+def chart_key(course: str, version: int, fp_time: int, sp_time: int, encoded: str) -> str:
+    return hashlib.sha1(f'{course}|{version}|{fp_time}|{sp_time}|{encoded}'.encode()).hexdigest()
+
+## Returns the cache key of a comparison chart of (course, term) pairs
+def comparison_key(series: list, versions: list, fp_time: int | None, sp_time: int | None, encoded: str) -> str:
+    charted = '|'.join(f'{course}@{term}@{version}' for (course, term), version in zip(series, versions))
+    return hashlib.sha1(f'compare|{charted}|{fp_time}|{sp_time}|{encoded}'.encode()).hexdigest()
+
+## Returns the file name to attach a chart's data stream under
+def filename(name: str, data_stream: io.BytesIO) -> str:
+    return f'{name}.{encoding.extension(data_stream.getvalue())}'
+
+def _get_background(course: str, version: int, data=None) -> Background:
+    key = (course, version)
+    with _backgrounds_lock:
+        if key in _backgrounds:
+            _backgrounds.move_to_end(key)
+            return _backgrounds[key]
+    background = Background(get_summary_index().get(course).steps if data is None else data, course)
+    with _backgrounds_lock:
+        background = _backgrounds.setdefault(key, background)
+        while len(_backgrounds) > _backgrounds_limit:
+            _backgrounds.popitem(last=False)
+    return background
+
+## Renders one course chart inside a worker from the course's change points. Takes the course
+# name rather than its data so only a few bytes cross the process boundary; each worker loads the
+# summaries on its own. data (store.Steps) is only passed for courses with rows appended since
+# ingestion, which workers cannot see.
+# Returns the chart encoded within budget bytes
+def render_enrollment(course: str, version: int, fp_time: int, sp_time: int, data=None, budget: int | None = None) -> Encoded:
+    return _get_background(course, version, data).render(fp_time, sp_time, budget)
+
+## Renders the fill percentages of several (course, term key) pairs into one chart inside a worker.
+# Other terms than the data term are drawn at the same points of the data term's schedule, and
+# labeled with their term. data maps the modified pairs to their change points, like render_enrollment.
+# Returns the chart encoded within budget bytes
+def render_comparison(series: list, fp_time: int | None, sp_time: int | None, data: dict | None = None, budget: int | None = None) -> Encoded:
+    global _comparison
+    with _backgrounds_lock:
+        if _comparison is None:
+            _comparison = ComparisonBackground()
+    data = data or {}
+    registry = get_registry()
+    buckets = int(_comparison.fig.get_figwidth() * DPI)
+    lines = []
+    for course, key in series:
+        term = registry.get(key)
+        steps = data[course, key] if (course, key) in data else get_summary_index(key).get(course).steps
+        shift = term.convert(0, registry.data_term)
+        label = course if term is registry.data_term else f'{course} ({term.name})'
+        lines.append((label, *fill_percentage(steps, buckets, shift)))
+    return _comparison.render(lines, fp_time, sp_time, budget)
+
+## Renders a missing chart of courses on the pool once user gets a render slot, and caches it
+async def _render_missing(key: str, courses: list, user, fn, *args) -> bytes:
+    # charts of several courses are only traced in aggregate
+    course = courses[0] if len(courses) == 1 else None
+    limiter = get_limiter()
+    with tracing.stage('render_queue', course):
+        await limiter.acquire(user)
+    try:
+        loop = asyncio.get_running_loop()
+        with tracing.stage('render', course):
+            encoded = await loop.run_in_executor(get_executor(), fn, *args)
+    finally:
+        limiter.release(user)
+    tracing.encoded(encoded.format, encoded.scale, len(encoded.data), encoded.seconds)
+    get_cache().put(key, encoded.data, *courses)
+    return encoded.data
+
+## Returns a chart from the cache, or renders it with fn(*args) on the pool without blocking the
+# event loop. Concurrent requests for the same chart wait on a single render; user (any hashable
+# id) is used to share render slots fairly.
+async def _cached(key: str, courses: list, user, fn, *args) -> io.BytesIO:
+    with tracing.stage('chart_cache', courses[0] if len(courses) == 1 else None):
+        image = get_cache().get(key)
+    if image is None:
+        image = await _flights.do(key, functools.partial(_render_missing, key, courses, user, fn, *args))
+    return io.BytesIO(image)
+
+## Returns a course chart from the cache, rendering it on the pool on a miss. Pass-time lines are
+# drawn at fp_time and sp_time (data term times, see pass_lines), and budget is the bytes the
+# chart may take in its message (default: chart_upload_budget_bytes)
+# Returns a data stream (io.BytesIO) containing the image of the plot; see filename()
+async def render(course: str, fp_time: int, sp_time: int, user=None, budget: int | None = None) -> io.BytesIO:
+    fp_time, sp_time = round_pass_time(fp_time), round_pass_time(sp_time)
+    budget = _encoding.budget if budget is None else budget
+    get_cache().record(course)
+    store = get_store()
+    version = store.version_of(course)
+    data = get_summary_index().get(course).steps if store.is_modified(course) else None
+    return await _cached(chart_key(course, version, fp_time, sp_time, _encoding.key(budget)), [course], user,
+                         render_enrollment, course, version, fp_time, sp_time, data, budget)
+
+## Returns one chart comparing the fill percentage of courses, from the cache or rendered on the
+# pool. series lists courses of the data term, or (course, term key) pairs to compare terms.
+# Pass-time lines are drawn when fp_time and sp_time are given (data term times, see pass_lines), and budget
+# is as in render()
+# Returns a data stream (io.BytesIO) containing the image of the plot; see filename()
+async def render_compare(series: list, fp_time: int | None = None, sp_time: int | None = None, user=None, budget: int | None = None) -> io.BytesIO:
+    if fp_time is not None and sp_time is not None:
+        fp_time, sp_time = round_pass_time(fp_time), round_pass_time(sp_time)
+    budget = _encoding.budget if budget is None else budget
+    data_term = get_registry().data_term.key
+    series = [(entry, data_term) if isinstance(entry, str) else tuple(entry) for entry in series]
+    versions = [get_store(term).version_of(course) for course, term in series]
+    data = {(course, term): get_summary_index(term).get(course).steps for course, term in series if get_store(term).is_modified(course)}
+    courses = list(dict.fromkeys(course for course, _ in series))
+    return await _cached(comparison_key(series, versions, fp_time, sp_time, _encoding.key(budget)), courses, user,
+                         render_comparison, series, fp_time, sp_time, data, budget)
+
+## Imports matplotlib and PIL in a worker and loads the fonts, by rendering an empty comparison
+# on the background that later comparisons reuse
+def _prime_worker():
+    render_comparison([], None, None)
+
+## Builds a course background in a worker so its first chart only draws the pass-time lines
+def _prime_background(course: str, version: int):
+    _get_background(course, version)
+
+## Primes every render worker and builds the backgrounds of the most requested courses, n at most.
+# Process workers each keep their own backgrounds, so a course is only warm in the worker that
+# built it. Returns the courses warmed up
+async def warm_up(n: int) -> list[str]:
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    # one job per worker, started together so each worker process gets one
+    await asyncio.gather(*(loop.run_in_executor(executor, _prime_worker) for _ in range(_workers)))
+    store = get_store()
+    courses = [course for course in get_cache().popular(n) if course in store and not store.is_modified(course)]
+    await asyncio.gather(*(loop.run_in_executor(executor, _prime_background, course, store.version_of(course)) for course in courses))
+    return courses
@@ -3,9 +3,24 @@ from discord.ext import pages
 from functions import *
 import paginator
 import modal
+import charts
+import tracing
+import warmup
+from summary import get_summary_index
+from faq import get_faq, title_of, to_embed
+from session import peek_session
+from terms import get_registry
+import asyncio
 import os
 from datetime import datetime
 
+# Most classes drawn in one /compare chart
+MAX_COMPARED = 8
+# Classes listed on each page of /fills
+FILLS_PER_PAGE = 15
+# Choices offered by /faq autocomplete (Discord allows at most 25)
+FAQ_CHOICES = 25
+
 bot = discord.Bot()
 
 '''@bot.slash_command(name = 'verbose', 
@@ -60,7 +75,158 @@ async def verbose(interaction, classes: str):
                    description = 'Provide a list of classes and see enrollment recommendations.')
 
 async def query(interaction):
-    await interaction.response.send_modal(modal.OverviewInputModal(bot, title='Input Details'))
+    # the modal starts from the user's last /query
+    session = peek_session(interaction.user.id if interaction.user else None)
+    await interaction.response.send_modal(modal.OverviewInputModal(bot, title='Input Details', session=session))
+
+@bot.slash_command(name = 'compare',
+                   description = 'Compare how quickly classes fill up in one chart. Usage: /compare classes:ECE 35, CSE 11, BILD 4')
+
+async def compare(interaction, classes: str, first_pass: str = None, second_pass: str = None, terms: str = None):
+    with tracing.interaction('compare'):
+        with tracing.stage('defer'):
+            await interaction.response.defer()
+        with tracing.stage('wait_indexes'):
+            await warmup.ready()
+
+        courses = list(map(str.strip, classes.split(',')))
+        with tracing.stage('resolve_courses'):
+            found, unreadable, suggested = modal.resolve_courses(courses)
+        if len(found) == 0:
+            await interaction.followup.send(embed=modal.no_results_embed(courses, suggested, '`/compare classes:ECE 35, CSE 11, BILD 4`'))
+            return
+        registry = get_registry()
+        # every course is drawn once for each term asked for, last year's term by default
+        keys = list(dict.fromkeys(map(str.strip, terms.upper().split(',')))) if terms else [registry.data_term.key]
+        unknown = [key for key in keys if key not in registry or not registry.get(key).has_data()]
+        keys = [key for key in keys if key not in unknown]
+        if not keys:
+            em = discord.Embed(title='No data for these terms', description=f'Terms with data: {", ".join(term.key for term in registry.with_data())}')
+            em.add_field(name='Your Query', value=f'`{terms}`')
+            await interaction.followup.send(embed=em)
+            return
+        loop = asyncio.get_running_loop()
+        with tracing.stage('load_terms'):
+            # other terms are opened on first use, which reads (or first ingests) their store
+            indexes = {key: await loop.run_in_executor(None, get_summary_index, key) for key in keys}
+        # a course listed twice is drawn once
+        series = [(course, key) for course in dict.fromkeys(found) for key in keys]
+        unrecorded = [f'{course} ({key})' for course, key in series if course not in indexes[key]]
+        series = [(course, key) for course, key in series if course in indexes[key]]
+        skipped = [f'{course} ({key})' if len(keys) > 1 else course for course, key in series[MAX_COMPARED:]]
+        series = series[:MAX_COMPARED]
+
+        em = discord.Embed(title='Comparison', description='Share of seats filled over last year\'s enrollment period.')
+        if keys != [registry.data_term.key]:
+            em.description = 'Share of seats filled, with every term\'s enrollment period lined up on last year\'s.'
+        pass_times = (None, None)
+        if first_pass and second_pass:
+            with tracing.stage('parse_times'):
+                try:
+                    enrollment_times = (int(parse_times(first_pass)), int(parse_times(second_pass)))
+                except ValueError as e:
+                    await interaction.followup.send(embed=modal.invalid_time_embed(e))
+                    return
+            em.description += f'\nYour first pass time: {datetime.utcfromtimestamp(enrollment_times[0])}\nYour second pass time: {datetime.utcfromtimestamp(enrollment_times[1])}'
+            pass_times = charts.pass_lines(*enrollment_times)
+
+        for course, key in series:
+            term = registry.get(key)
+            name = course if len(keys) == 1 else f'{course} ({term.name})'
+            capacity_seconds = indexes[key].get(course).capacity_seconds
+            if capacity_seconds is None:
+                em.add_field(name=name, value='Capacity never reached', inline=True)
+            else:
+                # shown at the same point of this term's schedule
+                em.add_field(name=name, value=f'Full on {datetime.utcfromtimestamp(term.convert(capacity_seconds, registry.current))}', inline=True)
+        if unreadable:
+            em.add_field(name='Invalid Classes', value='\n'.join(f'**{c}**' for c in unreadable), inline=False)
+        if unknown:
+            em.add_field(name='Unknown Terms', value=f'No data for **{", ".join(unknown)}**; terms with data: {", ".join(term.key for term in registry.with_data())}', inline=False)
+        if unrecorded:
+            em.add_field(name='Not Offered', value='\n'.join(f'**{c}**' for c in unrecorded), inline=False)
+        if skipped:
+            em.add_field(name='Not Shown', value=f'At most {MAX_COMPARED} classes fit in one chart: **{", ".join(skipped)}**', inline=False)
+
+        if not series:
+            await interaction.followup.send(embed=em)
+            return
+        data_stream = await charts.render_compare(series, *pass_times, interaction.user.id if interaction.user else None)
+        name = charts.filename('compare', data_stream)
+        chart = discord.File(data_stream, filename=name)
+        em.set_image(url=f'attachment://{name}')
+        with tracing.stage('upload'):
+            await interaction.followup.send(embed=em, file=chart)
+
+@bot.slash_command(name = 'fills',
+                   description = 'List every class expected to fill up before your first or second pass, earliest first.')
+
+async def fills(interaction, first_pass: str, second_pass: str, department: str = None):
+    with tracing.interaction('fills'):
+        with tracing.stage('defer'):
+            await interaction.response.defer()
+        with tracing.stage('wait_indexes'):
+            await warmup.ready()
+
+        with tracing.stage('parse_times'):
+            try:
+                enrollment_times = (int(parse_times(first_pass)), int(parse_times(second_pass)))
+            except ValueError as e:
+                await interaction.followup.send(embed=modal.invalid_time_embed(e))
+                return
+
+        # same cutoffs as get_overview: full at or before both passes, or after first pass but at or before second pass
+        with tracing.stage('capacity_lookup'):
+            index = get_summary_index().capacity_index()
+            before_first = index.filled_between(None, min(enrollment_times), department)
+            before_second = index.filled_between(enrollment_times[0], enrollment_times[1], department)
+
+        description = f'Your first pass time: {datetime.utcfromtimestamp(enrollment_times[0])}\nYour second pass time: {datetime.utcfromtimestamp(enrollment_times[1])}'
+        if department:
+            description += f'\nDepartment: {department.strip().upper()}'
+        description += f'\n{len(before_first)} classes are expected to be full before your first pass, {len(before_second)} more before your second pass.'
+
+        # (section, line) for every class, earliest first within each section
+        entries = [('Full Before Your First Pass', f'**{course}**: {datetime.utcfromtimestamp(seconds)}') for course, seconds in before_first]
+        entries += [('Full Before Your Second Pass', f'**{course}**: {datetime.utcfromtimestamp(seconds)}') for course, seconds in before_second]
+        if not entries:
+            await interaction.followup.send(embed=discord.Embed(title='No classes fill up before your passes', description=description))
+            return
+
+        results = []
+        for start in range(0, len(entries), FILLS_PER_PAGE):
+            em = discord.Embed(title='Classes Filling Before Your Passes', description=description)
+            page = entries[start:start + FILLS_PER_PAGE]
+            for section in dict.fromkeys(section for section, _ in page):
+                em.add_field(name=section, value='\n'.join(line for s, line in page if s == section), inline=False)
+            results.append(pages.Page(embeds=[em]))
+
+        msg = paginator.MultiPage(bot)
+        msg.set_pages(results)
+        with tracing.stage('paginate'):
+            await msg.paginate(interaction)
 
+## Suggests FAQ entries for what has been typed so far, best match first
+async def faq_autocomplete(ctx: discord.AutocompleteContext):
+    faq = get_faq()
+    entries = faq.search(ctx.value, FAQ_CHOICES) if ctx.value.strip() else faq.titled()[:FAQ_CHOICES]
+    return [discord.OptionChoice(name=title_of(entry)[:100], value=str(entry['id'])) for entry in entries if title_of(entry)]
 
+@bot.slash_command(name = 'faq',
+                   description = 'Search the frequently asked questions.')
 
+async def faq(interaction, question: discord.Option(str, 'What you want to know', autocomplete=faq_autocomplete)):
+    with tracing.interaction('faq'):
+        with tracing.stage('faq_search'):
+            entries = get_faq()
+            # picking an autocomplete choice sends its id; anything else typed is searched
+            entry = entries.get(int(question)) if question.isdigit() else None
+            if entry is None:
+                results = entries.search(question, 1)
+                entry = results[0] if results else None
+        if entry is None:
+            em = discord.Embed(title='No FAQ found', description='Nothing matched your question.')
+            em.add_field(name='Your Query', value=f'`{question}`')
+            await interaction.respond(embed=em)
+            return
+        await interaction.respond(embed=to_embed(entry))
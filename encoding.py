@@ -0,0 +1,100 @@
+import io
+import time
+from typing import NamedTuple
+
+## Encodes rendered charts for upload. Charts are flat colors, lines and text, so a palette PNG
+# (at most 256 colors) is around a third of the size of a full-color PNG and quicker to compress;
+# WebP is available where clients show it. Every chart is encoded to fit a byte budget per message:
+# if the configured format is too large, smaller formats and then lower resolutions are tried.
+# Configured with the optional config keys
+#   chart_format: 'palette' | 'png' | 'webp'  (default 'palette')
+#   chart_colors: int                         (palette size, 2 to 256, default 256)
+#   chart_png_compression: int                (zlib level, 0 to 9, default 6)
+#   chart_webp_quality: int                   (0 to 100, default 80)
+#   chart_upload_budget_bytes: int            (per message, 0 for no limit, default 256 KiB)
+
+FORMATS = ('palette', 'png', 'webp')
+DEFAULT_FORMAT = 'palette'
+COLORS = 256
+PNG_COMPRESSION = 6
+WEBP_QUALITY = 80
+UPLOAD_BUDGET_BYTES = 256 * 1024
+# Resolutions tried, largest first, when a chart does not fit its budget
+SCALES = (1.0, 0.75, 0.5)
+
+class Encoding(NamedTuple):
+    format: str = DEFAULT_FORMAT
+    colors: int = COLORS
+    png_compression: int = PNG_COMPRESSION
+    webp_quality: int = WEBP_QUALITY
+    budget: int = UPLOAD_BUDGET_BYTES
+
+    ## Returns what sets apart the images of this encoding under a budget, for cache keys
+    def key(self, budget: int) -> str:
+        return f'{self.format}:{self.colors}:{self.png_compression}:{self.webp_quality}:{budget}'
+
+## One encoded chart, and what it took
+class Encoded(NamedTuple):
+    data: bytes
+    format: str
+    scale: float
+    seconds: float
+    # encodings tried before one fit the budget, including it
+    attempts: int
+
+## Reads the encoding settings from the bot config
+def from_config(config: dict) -> Encoding:
+    encoding = Encoding(config.get('chart_format', DEFAULT_FORMAT),
+                        config.get('chart_colors', COLORS),
+                        config.get('chart_png_compression', PNG_COMPRESSION),
+                        config.get('chart_webp_quality', WEBP_QUALITY),
+                        config.get('chart_upload_budget_bytes', UPLOAD_BUDGET_BYTES))
+    if encoding.format not in FORMATS:
+        raise ValueError(f'Unknown chart_format {encoding.format!r}, expected one of {", ".join(FORMATS)}')
+    if encoding.format == 'webp':
+        from PIL import features
+        if not features.check('webp'):
+            raise ValueError('chart_format is "webp", but Pillow was built without WebP support')
+    return encoding
+
+## Returns the (format, scale) pairs to try for an encoding, preferred first
+def candidates(encoding: Encoding) -> list[tuple[str, float]]:
+    ladder = [(encoding.format, SCALES[0])]
+    # a full-color PNG first falls back to the much smaller palette PNG at the same resolution
+    smallest = 'palette' if encoding.format == 'png' else encoding.format
+    if smallest != encoding.format:
+        ladder.append((smallest, SCALES[0]))
+    ladder += [(smallest, scale) for scale in SCALES[1:]]
+    return ladder
+
+## Returns the bytes of an RGB image in one format
+def save(image, format: str, encoding: Encoding) -> bytes:
+    data_stream = io.BytesIO()
+    if format == 'palette':
+        from PIL import Image
+        image = image.quantize(encoding.colors, method=Image.Quantize.FASTOCTREE)
+        image.save(data_stream, format='png', compress_level=encoding.png_compression)
+    elif format == 'png':
+        image.save(data_stream, format='png', compress_level=encoding.png_compression)
+    else:
+        image.save(data_stream, format='webp', quality=encoding.webp_quality)
+    return data_stream.getvalue()
+
+## Encodes an image (PIL) in the first of the encoding's candidates that fits in budget bytes
+# (default: the encoding's budget; 0 for no limit). If none fits, the smallest one is returned
+def encode(image, encoding: Encoding, budget: int | None = None) -> Encoded:
+    from PIL import Image
+    budget = encoding.budget if budget is None else budget
+    began = time.perf_counter()
+    # charts are opaque, and every format is smaller without the alpha channel
+    image = image.convert('RGB')
+    ladder = candidates(encoding)
+    for attempt, (format, scale) in enumerate(ladder, start=1):
+        scaled = image if scale == 1 else image.resize((round(image.width * scale), round(image.height * scale)), Image.Resampling.LANCZOS)
+        data = save(scaled, format, encoding)
+        if not budget or len(data) <= budget or attempt == len(ladder):
+            return Encoded(data, format, scale, time.perf_counter() - began, attempt)
+
+## Returns the file extension of encoded image bytes
+def extension(data: bytes) -> str:
+    return 'webp' if data[:4] == b'RIFF' and data[8:12] == b'WEBP' else 'png'
@@ -0,0 +1,162 @@
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+
+import discord
+
+from functions import export_faq, import_faq
+
+## Searchable FAQ, loaded from faq.json.
+# Every entry's keywords, title and description are split into tokens, and an inverted index maps
+# each token to the entries containing it, weighted by where it appears. A prefix layer maps the
+# beginnings of tokens to the tokens themselves, so partially typed words (as in /faq autocomplete)
+# still find entries. Lookups only touch the postings of the query's tokens, never every entry.
+# The file is reloaded when it changes, and edits are written back with functions.export_faq.
+
+FAQ_FILE = 'faq.json'
+MAX_RESULTS = 25
+# Shortest prefix that is looked up in the prefix layer
+MIN_PREFIX = 2
+# How often, in seconds, faq.json is checked for changes
+REFRESH_INTERVAL = 10
+
+# Score of a token by the part of the entry it appears in
+WEIGHTS = {'keywords': 3.0, 'title': 2.0, 'description': 1.0}
+# Share of a token's score given to a match on a prefix of it
+PREFIX_WEIGHT = 0.5
+
+## Returns the lowercase words of some text
+def tokenize(text: str) -> list[str]:
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+## Returns an entry's title, or the start of its description if it has none
+def title_of(entry: dict) -> str:
+    embed_data = entry.get('embed_data', {})
+    return embed_data.get('title') or embed_data.get('description', '')[:100]
+
+## Builds the embed showing an entry
+def to_embed(entry: dict) -> discord.Embed:
+    embed_data = entry.get('embed_data', {})
+    embed = discord.Embed(title=embed_data.get('title') or None, description=embed_data.get('description') or None)
+    if embed_data.get('footer'):
+        embed.set_footer(text=embed_data['footer'])
+    if embed_data.get('thumbnail'):
+        embed.set_thumbnail(url=embed_data['thumbnail'])
+    if embed_data.get('author'):
+        embed.set_author(name=embed_data['author'])
+    return embed
+
+## Immutable index over one version of the FAQ entries
+class FaqIndex:
+    def __init__(self, entries: list[dict]):
+        self.entries = {entry['id']: entry for entry in entries}
+        # token -> {entry id: score}
+        self.postings = defaultdict(lambda: defaultdict(float))
+        for entry in entries:
+            embed_data = entry.get('embed_data', {})
+            fields = {
+                'keywords': ' '.join(entry.get('keywords', [])),
+                'title': embed_data.get('title', ''),
+                'description': embed_data.get('description', '')
+            }
+            for field, text in fields.items():
+                for token in set(tokenize(text)):
+                    self.postings[token][entry['id']] += WEIGHTS[field]
+        # prefix -> tokens starting with it
+        self.prefixes = defaultdict(set)
+        for token in self.postings:
+            for end in range(MIN_PREFIX, len(token)):
+                self.prefixes[token[:end]].add(token)
+
+    ## Returns up to limit entries matching the query, best match first
+    def search(self, query: str, limit: int = MAX_RESULTS) -> list[dict]:
+        scores = defaultdict(float)
+        for token in tokenize(query):
+            for entry_id, score in self.postings.get(token, {}).items():
+                scores[entry_id] += score
+            for longer in self.prefixes.get(token, ()):
+                for entry_id, score in self.postings[longer].items():
+                    scores[entry_id] += score * PREFIX_WEIGHT
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [self.entries[entry_id] for entry_id, _ in ranked[:limit]]
+
+class Faq:
+    def __init__(self, path: str = FAQ_FILE):
+        self.path = path
+        self.mtime = None
+        self.checked = 0
+        self.index = FaqIndex([])
+        # edits are read-modify-write on the file, one at a time
+        self.lock = threading.Lock()
+        self.refresh()
+
+    ## Rebuilds the index if faq.json changed since the last build
+    def refresh(self):
+        self.checked = time.monotonic()
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self.mtime:
+            return
+        index = FaqIndex(import_faq(self.path))
+        # swap in the finished index so searches never see a half-built one
+        self.index, self.mtime = index, mtime
+
+    def _refresh_if_due(self):
+        if time.monotonic() - self.checked >= REFRESH_INTERVAL:
+            self.refresh()
+
+    def __len__(self) -> int:
+        return len(self.index.entries)
+
+    ## Returns the entry with the given id, or None
+    def get(self, entry_id: int) -> dict | None:
+        self._refresh_if_due()
+        return self.index.entries.get(entry_id)
+
+    ## Returns up to limit entries matching the query, best match first
+    def search(self, query: str, limit: int = MAX_RESULTS) -> list[dict]:
+        self._refresh_if_due()
+        return self.index.search(query, limit)
+
+    ## Returns every entry that has a title, in id order
+    def titled(self) -> list[dict]:
+        self._refresh_if_due()
+        return [entry for _, entry in sorted(self.index.entries.items()) if title_of(entry)]
+
+    ## Adds an entry, or replaces the entry with the same id, and saves the file.
+    # Entries without an id get the next free one. Returns the saved entry
+    def save(self, entry: dict) -> dict:
+        with self.lock:
+            entries = {e['id']: e for e in import_faq(self.path)}
+            if entry.get('id') is None:
+                entry = {**entry, 'id': max(entries, default=-1) + 1}
+            entries[entry['id']] = entry
+            self._write(list(entries.values()))
+        return entry
+
+    ## Removes the entry with the given id and saves the file. Returns whether it existed
+    def remove(self, entry_id: int) -> bool:
+        with self.lock:
+            entries = import_faq(self.path)
+            kept = [entry for entry in entries if entry['id'] != entry_id]
+            if len(kept) == len(entries):
+                return False
+            self._write(kept)
+        return True
+
+    def _write(self, entries: list[dict]):
+        entries = sorted(entries, key=lambda entry: entry['id'])
+        export_faq(entries, self.path)
+        self.index, self.mtime = FaqIndex(entries), os.stat(self.path).st_mtime_ns
+
+_faq = None
+_faq_lock = threading.Lock()
+
+## Returns the process-wide FAQ, loaded on first use
+def get_faq() -> Faq:
+    global _faq
+    with _faq_lock:
+        if _faq is None:
+            _faq = Faq(FAQ_FILE)
+    return _faq
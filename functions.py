@@ -1,12 +1,21 @@
 import csv
 from datetime import datetime
+import functools
 import re
-from matplotlib import pyplot as plt, patches
 import os
 import json
 import io
+from typing import TYPE_CHECKING
 import discord
-from dateutil.parser import parse
+import numpy as np
+
+from terms import get_registry
+
+# matplotlib and dateutil are imported where they are first used: loading them takes most of the
+# bot's startup, and with process render workers the bot process never draws a chart
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+    from matplotlib.figure import Figure
 
 EPOCH = datetime(1970,1,1)
 VERBOSE = False
@@ -14,35 +23,11 @@ BUTTONS = [u"\u23EA", u"\u2B05", u"\u27A1", u"\u23E9"]
 MAX_SEARCH_RESULTS = 8
 GUILD_IDS = [1146364521234055208]
 
-# Enrollment times for 2023 Winter
-TIMES = [
-    datetime(2022, 11, 7, 8),  # first pass prio + seniors [0]
-    datetime(2022, 11, 9, 8),  # first pass juniors [1]
-    datetime(2022, 11, 10, 8), # first pass sophomores [2]
-    datetime(2022, 11, 11, 8), # first pass freshmen [3]
-    datetime(2022, 11, 14, 8), # second pass prio + seniors [4]
-    datetime(2022, 11, 16, 8), # second pass juniors [5]
-    datetime(2022, 11, 17, 8), # second pass sophomores [6]
-    datetime(2022, 11, 18, 8), # second pass freshmen [7]
-    datetime(2022, 11, 20),    # enrollment ends [8]
-    datetime(2023, 1, 4),      # classes start [9]
-    datetime(2023, 1, 21)      # deadline to enroll/add [10]
-]
-
-# Enrollment times for 2024 Winter
-TIMES_NEW = [
-    datetime(2023, 11, 14, 8), # first pass prio + seniors [0]
-    datetime(2023, 11, 16, 8), # first pass juniors [1]
-    datetime(2023, 11, 17, 8), # first pass sophomores [2]
-    datetime(2023, 11, 18, 8), # first pass freshmen [3]
-    datetime(2023, 11, 21, 8), # second pass prio + seniors [4]
-    datetime(2023, 11, 23, 8), # second pass juniors [5]
-    datetime(2023, 11, 24, 8), # second pass sophomores [6]
-    datetime(2023, 11, 25, 8), # second pass freshmen [7]
-    datetime(2023, 11, 27),    # enrollment ends [8]
-    datetime(2024, 1, 3),      # classes start [9]
-    datetime(2024, 1, 20)      # deadline to enroll/add [10]
-]
+# Enrollment times of the current term (TIMES_NEW), and of the term whose enrollment data predicts
+# it (TIMES), from the term registry (terms.json)
+_terms = get_registry()
+TIMES = _terms.data_term.times
+TIMES_NEW = _terms.current.times
 
 # String representations of each corresponding enrollment itme
 TIMES_TO_STR = [
@@ -67,8 +52,11 @@ def get_seconds(dt: datetime) -> int:
     return (dt - EPOCH).total_seconds()
 
 # Enrollment times in seconds
-SECONDS = list(map(get_seconds, TIMES))
-SECONDS_NEW = list(map(get_seconds, TIMES_NEW))
+SECONDS = _terms.data_term.seconds.tolist()
+SECONDS_NEW = _terms.current.seconds.tolist()
+
+# Time range shown in enrollment charts, a day around the pass windows
+X_LIM = (SECONDS[0] - 86400, SECONDS[8] + 86400)
 
 ## Reads the csv file and returns data in the following format:
 # - [seconds, [enrolled, available, waitlisted, total]]
@@ -92,12 +80,12 @@ def readcsv(filepath: str) -> list[dict]:
             })
         return data
 
-## Converts a new enrollment time to an old (1 year ago) enrollment time
+## Converts an enrollment time of the current term to the same point of the data term
 # Returns the old time, in seconds
 def new_to_old(enrollment_time: int) -> int:
     return enrollment_time - (SECONDS_NEW[0] - SECONDS[0])
 
-## Converts an old enrollment time (1 year ago) to a new enrollment time
+## Converts an enrollment time of the data term to the same point of the current term
 # Returns the new time, in seconds
 def old_to_new(enrollment_time: int) -> int:
     return enrollment_time + (SECONDS_NEW[0] - SECONDS[0])
@@ -232,27 +220,77 @@ def get_info(data: list, course: str, standing: int) -> discord.Embed:
 
     return embed
 
-## Creates a graph of the enrollment plot centered around the enrollment period
-# Returns a data stream (io.BytesIO) containing the image of the plot
-def plot_enrollment(data: list, course: str, fp_time: int, sp_time: int) -> io.BytesIO:
+## Picks the snapshots worth drawing when [start, stop] is drawn about `buckets` pixels wide.
+# Keeps the first, last, lowest and highest snapshot of every series in each bucket (min/max
+# bucketing), so peaks and step changes land on the same pixels as with every snapshot drawn, and
+# one snapshot on each side of the window so the lines still run to its edges.
+# Returns sorted snapshot indices
+def decimate(seconds, series: list, start: int, stop: int, buckets: int) -> np.ndarray:
+    lo = max(int(np.searchsorted(seconds, start, side='left')) - 1, 0)
+    hi = min(int(np.searchsorted(seconds, stop, side='right')) + 1, len(seconds))
+    if hi - lo <= 4 * buckets:
+        return np.arange(lo, hi)
+
+    window = np.asarray(seconds[lo:hi])
+    # the snapshots outside the window get buckets -1 and `buckets` of their own
+    bucket = np.clip((window - start) * buckets // (stop - start), -1, buckets)
+    bounds = np.flatnonzero(np.diff(bucket)) + 1
+    firsts = np.concatenate(([0], bounds))
+    lasts = np.concatenate((bounds - 1, [len(window) - 1]))
+    keep = [firsts, lasts]
+    for values in series:
+        # bucket is already sorted, so each bucket keeps its place and is ordered by value inside
+        order = np.lexsort((np.asarray(values[lo:hi]), bucket))
+        keep += [order[firsts], order[lasts]]
+    return lo + np.unique(np.concatenate(keep))
+
+## Creates a figure with one axes on its own Agg canvas
+# Returns (figure, axes)
+def new_figure(dpi: int = 100) -> tuple['Figure', 'Axes']:
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(dpi=dpi)
+    FigureCanvasAgg(fig)
+    return fig, fig.subplots()
+
+## Draws everything in the enrollment plot except the pass-time lines: data lines, ticks and
+# the background rectangles for each pass. Uses a standalone Figure and Agg canvas (no pyplot
+# state), so it is safe to call from worker threads
+# data: store.CourseData with one array per column, or the course's change points (store.Steps)
+# Returns (figure, axes, y limit)
+def plot_background(data, course: str, dpi: int = 100) -> tuple['Figure', 'Axes', float]:
+    # the same line either way: change points are drawn through the first and last snapshot of each run
+    data = data.polyline()
+
+    fig, ax = new_figure(dpi)
+
+    ax.set_title(f'Enrollment Period for {course} for {_terms.data_term.name}')
+    ax.set_ylabel('Total Seats')
 
-    data_stream = io.BytesIO()
+    # only the snapshots visible at the figure's pixel width are drawn
+    shown = decimate(data.seconds, [data.enrolled, data.total, data.waitlisted], *X_LIM, int(fig.get_figwidth() * dpi))
+    seconds = data.seconds[shown]
 
-    fig, ax = plt.subplots()
+    ax.plot(seconds, data.enrolled[shown], color='red')
+    ax.plot(seconds, data.total[shown], color='purple')
+    ax.plot(seconds, data.waitlisted[shown], color='blue')
 
-    ax.set_title(f'Enrollment Period for {course} for Winter 2023')
-    ax.set_ylabel('Total Seats')
 
-    ax.plot([e['seconds'] for e in data], [e['enrolled'] for e in data], color='red')
-    ax.plot([e['seconds'] for e in data], [e['total'] for e in data], color='purple')
-    ax.plot([e['seconds'] for e in data], [e['waitlisted'] for e in data], color='blue')
+    y_lim = data.total.max() * 1.05
+
+    plot_periods(ax, y_lim)
 
+    return fig, ax, y_lim
 
-    y_lim = max([e['total'] for e in data]) * 1.05
+## Draws what every enrollment chart shares: the enrollment window with a tick per milestone,
+# and the background rectangles for each pass
+def plot_periods(ax: 'Axes', y_lim: float):
+    from matplotlib import patches
 
     ax.set_xticks(list(map(get_seconds, TIMES)))
     ax.set_xticklabels(TIMES)
-    ax.set(xlim=(SECONDS[0] - 86400, SECONDS[8] + 86400),
+    ax.set(xlim=X_LIM,
         ylim=(0, y_lim))
 
     ax.yaxis.grid()
@@ -271,18 +309,104 @@ def plot_enrollment(data: list, course: str, fp_time: int, sp_time: int) -> io.B
         cy = ry + rectangle.get_height()/2.0
         ax.annotate(TIMES_TO_STR[i], (cx, cy), color='#424242', weight='bold', fontsize=10, ha='center', va='center', rotation=90)
 
+    for label in ax.get_xticklabels():
+        label.set(rotation=30, horizontalalignment='right')
+
+## Draws the background of a chart comparing courses: the enrollment window and pass rectangles,
+# on a y axis of the percentage of seats filled
+# Returns (figure, axes, y limit)
+def plot_comparison_background(dpi: int = 100) -> tuple['Figure', 'Axes', float]:
+
+    fig, ax = new_figure(dpi)
+
+    ax.set_title(f'Enrollment Comparison for {_terms.data_term.name}')
+    ax.set_ylabel('Seats Filled (%)')
+
+    y_lim = 100 * 1.05
+    plot_periods(ax, y_lim)
+
+    return fig, ax, y_lim
+
+## Returns the points of a course's fill percentage (enrolled / total) to draw in a comparison
+# about `buckets` pixels wide, as (seconds, percentages)
+# data: store.CourseData or store.Steps
+def fill_percentage(data, buckets: int, shift: float = 0) -> tuple[np.ndarray, np.ndarray]:
+    data = data.polyline()
+    # data of another term is moved onto the chart's timeline first
+    seconds = data.seconds + shift
+    percentage = 100 * data.enrolled / np.maximum(data.total, 1)
+    shown = decimate(seconds, [percentage], *X_LIM, buckets)
+    return seconds[shown], percentage[shown]
+
+## Creates a graph of the enrollment plot centered around the enrollment period
+# Returns a data stream (io.BytesIO) containing the image of the plot
+def plot_enrollment(data, course: str, fp_time: int, sp_time: int) -> io.BytesIO:
+
+    data_stream = io.BytesIO()
+
+    fig, ax, y_lim = plot_background(data, course)
+
     ax.vlines(x=[fp_time, sp_time], ymin=0, ymax=y_lim, colors='black', label='Enrollment Time')
 
-    plt.setp(ax.get_xticklabels(), rotation=30, horizontalalignment='right')
-    
-    plt.savefig(data_stream, format='png', bbox_inches="tight", dpi = 80)
-    plt.close()
+    fig.savefig(data_stream, format='png', bbox_inches="tight", dpi = 80)
 
     return data_stream
 
+MONTHS = {month: number for number, names in enumerate([
+    ('jan', 'january'), ('feb', 'february'), ('mar', 'march'), ('apr', 'april'), ('may',), ('jun', 'june'),
+    ('jul', 'july'), ('aug', 'august'), ('sep', 'sept', 'september'), ('oct', 'october'), ('nov', 'november'),
+    ('dec', 'december')], start=1) for month in names}
+
+# Time of day after a date: 8, 8am, 8:00, 8:00 am, 08:00:00, 8:00 PM
+_CLOCK = r'(?:[ t,]+(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?(?::(?P<second>\d{2}))?\s*(?P<meridiem>[ap]\.?m\.?)?)?'
+# The formats pass times are usually typed in: 2023-11-14 08:00, 11/14 8:00am, 11/14/2023 8am,
+# Nov 14 8am, November 14, 2023 8:00 PM
+_PASS_TIME_FORMATS = [
+    re.compile(r'(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})' + _CLOCK),
+    re.compile(r'(?P<month>\d{1,2})/(?P<day>\d{1,2})(?:/(?P<year>\d{4}))?' + _CLOCK),
+    re.compile(r'(?P<month>[a-z]+)\.? (?P<day>\d{1,2})(?:st|nd|rd|th)?(?:,? (?P<year>\d{4}))?' + _CLOCK)
+]
+
+## Parses the common pass time formats without dateutil. Dates without a year are in the current
+# term's year. Returns None for anything else
+def _parse_common(text: str) -> datetime | None:
+    for pattern in _PASS_TIME_FORMATS:
+        match = pattern.fullmatch(text)
+        if match is None:
+            continue
+        month = match['month']
+        month = MONTHS.get(month) if month.isalpha() else int(month)
+        hour = int(match['hour'] or 0)
+        if match['meridiem']:
+            if not 1 <= hour <= 12:
+                return None
+            hour = hour % 12 + (12 if match['meridiem'][0] == 'p' else 0)
+        try:
+            return datetime(int(match['year'] or TIMES_NEW[0].year), month, int(match['day']),
+                            hour, int(match['minute'] or 0), int(match['second'] or 0))
+        except (TypeError, ValueError):
+            return None
+    return None
+
 ## Parse the time given into seconds format
-def parse_times(time):
-    return get_seconds(parse(time))
+# Common formats are parsed directly and anything else by dateutil; either way the time has to fall
+# in the current term's enrollment period (first pass to registration closing).
+# Raises ValueError with a message for the user otherwise
+@functools.lru_cache(maxsize=4096)
+def parse_times(time: str) -> float:
+    text = ' '.join(time.strip().lower().split())
+    parsed = _parse_common(text)
+    if parsed is None:
+        from dateutil.parser import ParserError, parse
+        try:
+            parsed = parse(text, default=datetime(TIMES_NEW[0].year, 1, 1))
+        except (ParserError, OverflowError):
+            raise ValueError(f'Could not read the time `{time}`. Try a format like `11/14 8:00am`.')
+    seconds = get_seconds(parsed)
+    if not SECONDS_NEW[0] <= seconds <= SECONDS_NEW[8]:
+        raise ValueError(f'`{time}` ({parsed:%b %d %I:%M %p}) is outside enrollment for {_terms.current.name}, '
+                         f'{TIMES_NEW[0]:%b %d} to {TIMES_NEW[8]:%b %d}.')
+    return seconds
 
 ## Loads the config json file.
 # Returns a dictionary in the form
@@ -301,13 +425,21 @@ def config_load() -> dict:
 #   {
 #       embed_data: dict
 #       keywords: List[str]
+#       id: int
 #   }
 # ]
-def import_faq():
-    with open(os.path.join(os.getcwd(), 'faq.json')) as f:
+def import_faq(path: str = 'faq.json'):
+    with open(os.path.join(os.getcwd(), path)) as f:
         data = json.load(f)
         return data
 
 ## Writes to the faq file.
-def export_faq(faq):
-    pass
\ No newline at end of file
+# The list is written to a temporary file first and renamed over the faq file, so readers (and the
+# bot reloading it) only ever see the old or the new file, never a partial one
+def export_faq(faq, path: str = 'faq.json'):
+    path = os.path.join(os.getcwd(), path)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(faq, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
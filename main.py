@@ -1,9 +1,22 @@
+import tracing
 from functions import config_load
 from commands import *
+import charts
+import warmup
+import watcher
 
 @bot.event
 async def on_ready():
+    tracing.milestone('ready')
+    await tracing.start()
+    # indexes and render workers warm up in the background; queries arriving first load what they need
+    warmup.start(config)
+    watcher.start(config)
     print("Ready!")
 
-config = config_load()
-bot.run(config['token'])
\ No newline at end of file
+# render workers are spawned and re-import this module, so only the bot process starts the bot
+if __name__ == '__main__':
+    config = config_load()
+    charts.configure(config)
+    tracing.configure(config)
+    bot.run(config['token'])
\ No newline at end of file
@@ -1,56 +1,107 @@
+import functools
 import discord
 from functions import parse_times
-import os
 import paginator
 from discord.ext import pages
-from functions import plot_enrollment, readcsv, get_overview
+import charts
+import tracing
+import warmup
+from store import get_store
+from catalog import get_catalog
+from session import Session, get_session
 from datetime import datetime
 
+## Plots the enrollment of a course and returns its page with the chart stored into the embed
+async def course_page(course: str, embed: discord.Embed, enrollment_times: tuple, user=None) -> pages.Page:
+    data_stream = await charts.render(course, *charts.pass_lines(*enrollment_times), user)
+    data_stream.seek(0)
+    name = charts.filename(course, data_stream)
+    chart = discord.File(data_stream, filename=name)
+    embed.set_image(
+        url=f'attachment://{name}'
+    )
+    return pages.Page(embeds=[embed], files=[chart])
+
+## Resolves the class names a user typed against the course catalog, through the user's session
+# if given
+# Returns (courses in the store, unreadable inputs with any suggestions, every suggestion offered)
+def resolve_courses(courses: list[str], session: Session | None = None) -> tuple[list[str], list[str], list[str]]:
+    # sessions resolve like the catalog, remembering the answers
+    resolver = session or get_catalog()
+    classes = []
+    unreadable = []
+    suggested = []
+    for c in courses:
+        if not c:
+            continue
+        # resolve the input against the course catalog; if unreadable, report it with suggestions
+        course, suggestions = resolver.resolve(c)
+        if course is None or course not in get_store():
+            unreadable.append(f'{c} (did you mean {" / ".join(suggestions)}?)' if suggestions else c)
+            suggested.extend(suggestions)
+            continue
+        classes.append(course)
+    return classes, unreadable, suggested
+
+## Returns the embed sent when none of the classes in a query could be read
+def no_results_embed(courses: list[str], suggested: list[str], usage: str) -> discord.Embed:
+    em = discord.Embed(title='No results found!', description='Please check your spelling(s) and make sure the classes are properly comma-separated. If this class was not offered last year winter quarter, it will not show up here.')
+    em.add_field(name='Usage', value=usage)
+    em.add_field(name='Your Query', value=f'`{courses}`')
+    if suggested:
+        em.add_field(name='Did You Mean', value=f'**{", ".join(suggested)}**', inline=False)
+    return em
+
+## Returns the embed sent when a pass time could not be read or is outside enrollment
+def invalid_time_embed(error: ValueError) -> discord.Embed:
+    return discord.Embed(title='Invalid pass time', description=str(error))
+
 class OverviewInputModal(discord.ui.Modal):
-    def __init__(self, bot, *args, **kwargs) -> None:
+    ## session: the user's session, whose last inputs pre-fill the fields
+    def __init__(self, bot, *args, session: Session | None = None, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         
         self.bot = bot
 
-        self.add_item(discord.ui.InputText(label="Class List (comma separated)", style=discord.InputTextStyle.short))
-        self.add_item(discord.ui.InputText(label="First Pass Enrollment Time", style=discord.InputTextStyle.short))
-        self.add_item(discord.ui.InputText(label="Second Pass Enrollment Time", style=discord.InputTextStyle.short))
+        inputs = session.inputs if session and session.inputs else (None, None, None)
+        self.add_item(discord.ui.InputText(label="Class List (comma separated)", style=discord.InputTextStyle.short, value=inputs[0]))
+        self.add_item(discord.ui.InputText(label="First Pass Enrollment Time", style=discord.InputTextStyle.short, value=inputs[1]))
+        self.add_item(discord.ui.InputText(label="Second Pass Enrollment Time", style=discord.InputTextStyle.short, value=inputs[2]))
 
     async def callback(self, interaction: discord.Interaction):
+        with tracing.interaction('query'):
+            await self.submit(interaction)
+
+    async def submit(self, interaction: discord.Interaction):
+        # acknowledge right away; everything below is sent as followups
+        with tracing.stage('defer'):
+            await interaction.response.defer()
+        # the store, summaries and catalog may still be loading on the warm-up thread
+        with tracing.stage('wait_indexes'):
+            await warmup.ready()
+
+        # the next /query of this user starts from these inputs
+        session = get_session(interaction.user.id if interaction.user else None)
+        session.inputs = tuple(child.value for child in self.children)
+
         courses = list(map(str.strip, self.children[0].value.split(',')))
-        unreadable = []
-        classes = []
-        
-        for c in courses:
-        # check if course is readable; first collapse all spaces and go to uppercase
-            course = c.replace(' ', '').upper()
-
-            # reformat to add the space back
-            for i in range(2, 5):
-                if course[:i].isalpha() and course[i].isdigit():
-                    course = course[:i] + ' ' + course[i:]
-                    # if unreadable, skip
-                    if not os.path.exists(f'../csv/{course}.csv'):
-                        print(f'../csv/{course}.csv')
-                        unreadable.append(c)
-                        continue
-                    classes.append(course)
-                    break
-        print(unreadable)
-        print(classes)
+
+        with tracing.stage('resolve_courses'):
+            classes, unreadable, suggested = resolve_courses(courses, session)
         if len(classes)==0:
-            em = discord.Embed(title='No results found!', description='Please check your spelling(s) and make sure the classes are properly comma-separated. If this class was not offered last year winter quarter, it will not show up here.')
-            em.add_field(name='Usage', value='`/query`')
-            em.add_field(name='Your Query', value=f'`{courses}`')
-            await interaction.response.send_message(embed=em)
+            await interaction.followup.send(embed=no_results_embed(courses, suggested, '`/query`'))
             return
         
-        fp_time, sp_time = parse_times(self.children[1].value), parse_times(self.children[2].value)
+        with tracing.stage('parse_times'):
+            try:
+                fp_time, sp_time = parse_times(self.children[1].value), parse_times(self.children[2].value)
+            except ValueError as e:
+                await interaction.followup.send(embed=invalid_time_embed(e))
+                return
         
-        await self.overview(interaction, classes, fp_time, sp_time)
+        await self.overview(interaction, classes, fp_time, sp_time, unreadable)
         
-    async def overview(self, interaction, classes: str, first_pass_time: str, second_pass_time: str):
-
+    async def overview(self, interaction, classes: str, first_pass_time: str, second_pass_time: str, unreadable: list = None):
         enrollment_times = (int(first_pass_time), int(second_pass_time))
 
         # enrollment_times: Tuple[int], contains the first and second pass times in seconds since epoch
@@ -62,8 +113,15 @@ class OverviewInputModal(discord.ui.Modal):
         # results: List[pages.Page], to be displayed in the paginator
         results = [pages.Page(embeds=[main_em])]
 
+        # course_pages: List[page factory], one per course, rendered by the paginator when shown
+        course_pages = []
+
+        # charts rendered for this user share render slots fairly with everyone else's
+        user = interaction.user.id if interaction.user else None
+        session = get_session(user)
+
         # unreadable: List[str], for all invalid courses
-        unreadable = []
+        unreadable = unreadable or []
 
         # List[str], course lists for each type
         fp_only = []
@@ -77,12 +135,10 @@ class OverviewInputModal(discord.ui.Modal):
         for course in classes:
             if "CSE" in course:
                 has_priority_wl.append(course)
-            # read course data
-            filepath = f'../csv/{course}.csv'
-            data = readcsv(filepath)
-
-            # get overview of data and store in result
-            result = get_overview(data, course, enrollment_times)
+            # get overview of the course from the precomputed summaries (or this user's last query
+            # with the same pass times) and store in result
+            with tracing.stage('get_overview', course):
+                result = session.overview(course, enrollment_times)
 
             # summary: List[str], stores results to be used in embed's course summary
             summary = None
@@ -115,16 +171,8 @@ class OverviewInputModal(discord.ui.Modal):
                     summary.append('**N/A**')
 
             main_em.add_field(name=course, value=f'First Pass: {summary[0]}\nSecond Pass: {summary[1]}\nClasses Start: {summary[2]}\nOff Waitlist: {summary[3]}', inline=True)
-            embed = result['embed']
-
-            # plot the enrollment and store it into the embed
-            data_stream = plot_enrollment(data, course, enrollment_times[0], enrollment_times[1])
-            data_stream.seek(0)
-            chart = discord.File(data_stream, filename=f'{course}.png')
-            embed.set_image(
-                url=f'attachment://{course}.png'
-            )
-            results.append(pages.Page(embeds=[embed], files=[chart]))
+            # the course page and its chart are rendered once the page is shown, after the overview is sent
+            course_pages.append(functools.partial(course_page, course, result['embed'], enrollment_times, user))
 
         rec = []
         if fp_only:
@@ -139,9 +187,11 @@ class OverviewInputModal(discord.ui.Modal):
             rec.append(f'Do not expect to get the following courses):\n**{", ".join(drop)}**')
         main_em.add_field(name='Recommendations', value='\n\n'.join(rec), inline=False)
         if unreadable:
-            main_em.add_field(name='Invalid Classes', value=f'**{", ".join(unreadable)}**', inline=False)
+            main_em.add_field(name='Invalid Classes', value='\n'.join(f'**{c}**' for c in unreadable), inline=False)
         if has_priority_wl:
             main_em.add_field(name='Waitlist Priority', value=f"You selected one or more classes which may have major priority ({', '.join(has_priority_wl)}), which means that you may not need to first pass it if you are in the department's major. Please refer to the department's website for more details.")
         msg = paginator.MultiPage(self.bot)
         msg.set_pages(results)
-        await msg.paginate(interaction)
\ No newline at end of file
+        with tracing.stage('paginate'):
+            await msg.paginate(interaction)
+        msg.add_pages(course_pages)
\ No newline at end of file
@@ -1,15 +1,109 @@
+import asyncio
 import discord
 from discord.ext import commands, pages
+import tracing
+
+# Pages added to a live paginator are shown in its page indicator after at most this many seconds,
+# so a burst of pages costs one message edit instead of one each
+REFRESH_DELAY = 1
+
+
+## Returns the page shown in place of a page that failed to render
+def error_page() -> pages.Page:
+    return pages.Page(embeds=[discord.Embed(title='Something went wrong',
+                                            description='This page could not be loaded. Please try your query again later.')])
+
+## A Paginator whose pages can be given as factories: coroutine functions returning a pages.Page.
+# A factory is only awaited when its page is first shown, and the page after it is prefetched in
+# the background. Rendered pages replace their factories and are kept for the paginator's lifetime.
+class LazyPaginator(pages.Paginator):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # page number -> task rendering that page
+        self.renders = {}
+        # pending edit showing newly added pages, if any
+        self.refresh = None
+
+    ## Returns the rendered page at page_number, awaiting its factory if needed
+    async def resolve(self, page_number: int) -> pages.Page:
+        page = self.pages[page_number]
+        if not callable(page):
+            return page
+        if page_number not in self.renders:
+            self.renders[page_number] = asyncio.ensure_future(page())
+        try:
+            rendered = await self.renders[page_number]
+        except Exception as e:
+            # one failed render only replaces its own page
+            print(f'Rendering page {page_number} failed: {e!r}')
+            rendered = error_page()
+        finally:
+            self.renders.pop(page_number, None)
+        if self.pages[page_number] is page:
+            self.pages[page_number] = rendered
+        return self.pages[page_number]
+
+    ## Starts rendering the page after page_number in the background
+    def prefetch(self, page_number: int):
+        if not self.pages:
+            return
+        following = 0 if page_number >= self.page_count and self.loop_pages else page_number + 1
+        if following < len(self.pages) and callable(self.pages[following]) and following not in self.renders:
+            asyncio.ensure_future(self.resolve(following))
+
+    ## Appends a page (or page factory) to the paginator, updating the sent message shortly after
+    def add_page(self, page):
+        self.pages.append(page)
+        self.page_count = len(self.pages) - 1
+        if self.refresh is None:
+            self.refresh = asyncio.ensure_future(self._refresh())
+
+    async def _refresh(self):
+        await asyncio.sleep(REFRESH_DELAY)
+        self.refresh = None
+        if self.message is None or self.is_finished():
+            return
+        self.update_buttons()
+        with tracing.stage('page_refresh'):
+            await self.message.edit(view=self)
+
+    async def goto_page(self, page_number: int = 0, *, interaction: discord.Interaction | None = None) -> None:
+        with tracing.stage('goto_page'):
+            if interaction is not None and callable(self.pages[page_number]):
+                # the render can take longer than Discord waits for a button click to be acknowledged,
+                # so acknowledge it first and edit the message once the page is ready
+                await interaction.response.defer()
+                interaction = None
+            await self.resolve(page_number)
+            await super().goto_page(page_number, interaction=interaction)
+        self.prefetch(page_number)
+
+    async def respond(self, *args, **kwargs):
+        await self.resolve(self.current_page)
+        message = await super().respond(*args, **kwargs)
+        self.prefetch(self.current_page)
+        return message
+
+    async def on_timeout(self) -> None:
+        await super().on_timeout()
+        for render in self.renders.values():
+            render.cancel()
+        self.renders.clear()
+        if self.refresh is not None:
+            self.refresh.cancel()
 
 
 class MultiPage(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.pages = []
+        self.paginator = None
 
     def get_pages(self):
         return self.pages
-    
+
+    ## Sets the pages to show. Each one is either a pages.Page or a factory
+    # (coroutine function returning a pages.Page) that is rendered when the page is first shown
     def set_pages(self, pages):
         self.pages = pages
 
@@ -26,14 +120,23 @@ class MultiPage(commands.Cog):
             pages.PaginatorButton("next", emoji="➡", style=discord.ButtonStyle.green),
             pages.PaginatorButton("last", emoji="⏩", style=discord.ButtonStyle.green),
         ]
-        paginator = pages.Paginator(
+        self.paginator = LazyPaginator(
             pages=self.get_pages(),
             show_disabled=True,
             show_indicator=True,
             use_default_buttons=False,
             custom_buttons=page_buttons,
             loop_pages=True,
-            disable_on_timeout=True, 
+            disable_on_timeout=True,
             timeout=180
         )
-        await paginator.respond(ctx, ephemeral=False)
\ No newline at end of file
+        await self.paginator.respond(ctx, ephemeral=False)
+
+    ## Adds page factories to the sent paginator. Like every factory page, each one is only
+    # rendered when it is first shown or is next after the page shown
+    def add_pages(self, factories):
+        if self.paginator.is_finished():
+            return
+        for factory in factories:
+            self.paginator.add_page(factory)
+        self.paginator.prefetch(self.paginator.current_page)
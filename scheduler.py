@@ -0,0 +1,89 @@
+import asyncio
+from collections import Counter, OrderedDict, deque
+
+## Request coalescing and fair admission for expensive per-course work.
+# SingleFlight lets concurrent callers asking for the same key share one in-flight task instead of
+# each doing the work. FairLimiter bounds how many tasks run at once, overall and per user, and
+# hands free slots to waiting users in turn, so one long class list cannot starve everyone else.
+
+## Runs at most one task per key at a time; concurrent callers of the same key await that task
+class SingleFlight:
+    def __init__(self):
+        self.flights = {}
+        # key -> number of callers awaiting the flight
+        self.waiters = Counter()
+
+    ## Returns the result of fn(), or of the call already in flight for key.
+    # A flight is cancelled once every caller awaiting it has been cancelled
+    async def do(self, key, fn):
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(fn())
+            self.flights[key] = flight
+            flight.add_done_callback(lambda done: self._finish(key, done))
+        self.waiters[key] += 1
+        try:
+            return await asyncio.shield(flight)
+        finally:
+            self.waiters[key] -= 1
+            if self.waiters[key] == 0:
+                del self.waiters[key]
+                if not flight.done():
+                    flight.cancel()
+
+    def _finish(self, key, flight: asyncio.Future):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        # the callers may all be gone; retrieve the exception so it is not reported as unhandled
+        if not flight.cancelled():
+            flight.exception()
+
+## Concurrency limit with a per-user cap and round-robin hand-off between waiting users
+class FairLimiter:
+    def __init__(self, limit: int, per_user: int):
+        self.limit = limit
+        self.per_user = per_user
+        self.active = 0
+        # user -> slots held
+        self.running = Counter()
+        # user -> waiting futures, in the order users are served
+        self.waiting = OrderedDict()
+
+    async def acquire(self, user=None):
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(user, deque()).append(future)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # cancelled right after being granted a slot: hand it on
+            if future.done() and not future.cancelled():
+                self.release(user)
+            raise
+
+    def release(self, user=None):
+        self.active -= 1
+        self.running[user] -= 1
+        if not self.running[user]:
+            del self.running[user]
+        self._dispatch()
+
+    ## Grants free slots, taking one waiter from each user below their cap in turn
+    def _dispatch(self):
+        while self.active < self.limit:
+            for user, queue in self.waiting.items():
+                if self.running[user] < self.per_user:
+                    break
+            else:
+                return
+            future = queue.popleft()
+            if queue:
+                # served; go to the back of the line
+                self.waiting.move_to_end(user)
+            else:
+                del self.waiting[user]
+            if future.cancelled():
+                continue
+            self.active += 1
+            self.running[user] += 1
+            future.set_result(None)
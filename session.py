@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+
+from catalog import get_catalog, normalize
+from store import get_store
+from summary import get_summary_index
+
+## Per-user memory of recent /query submissions. Users resubmit /query many times while changing
+# their class list, so each user's last inputs pre-fill the next modal, and the courses they
+# resolved and the overviews computed for them are reused. Cached overviews are keyed by the
+# course's data version, and resolved names by the catalog's version, so new data is never hidden.
+
+# Sessions unused for this many seconds are forgotten
+SESSION_TTL = 3600
+MAX_SESSIONS = 4096
+
+class Session:
+    def __init__(self):
+        self.used = time.monotonic()
+        # last modal inputs: class list, first pass, second pass
+        self.inputs = None
+        # what each class input resolved to, for one catalog version
+        self.catalog_version = None
+        self.resolved = {}
+        # (course, data version, first pass, second pass) -> overview
+        self.overviews = {}
+
+    ## Returns what a class input resolves to in the catalog, as catalog.resolve
+    def resolve(self, text: str) -> tuple[str | None, list[str]]:
+        catalog = get_catalog()
+        version = catalog.version()
+        if version != self.catalog_version:
+            self.catalog_version = version
+            self.resolved = {}
+        key = normalize(text)
+        if key not in self.resolved:
+            self.resolved[key] = catalog.resolve(text)
+        return self.resolved[key]
+
+    ## Returns a course's overview (SummaryIndex.overview), computed once per data version and
+    # pass times. Its embed is a copy, so pages of earlier queries keep their own
+    def overview(self, course: str, enrollment_times: tuple) -> dict:
+        key = (course, get_store().version_of(course), *enrollment_times)
+        if key not in self.overviews:
+            # overviews of the previous pass times are not asked for again
+            self.overviews = {k: v for k, v in self.overviews.items() if k[2:] == key[2:]}
+            self.overviews[key] = get_summary_index().overview(course, enrollment_times)
+        result = self.overviews[key]
+        return {**result, 'embed': result['embed'].copy()}
+
+## Recently active sessions, least recently used first
+class Sessions:
+    def __init__(self, ttl: int = SESSION_TTL, limit: int = MAX_SESSIONS):
+        self.ttl = ttl
+        self.limit = limit
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    ## Returns the session of a user, or None if they have none
+    def peek(self, user) -> Session | None:
+        with self.lock:
+            self._expire()
+            return self.sessions.get(user)
+
+    ## Returns the session of a user, starting one if needed
+    def get(self, user) -> Session:
+        with self.lock:
+            self._expire()
+            session = self.sessions.get(user)
+            if session is None:
+                session = self.sessions[user] = Session()
+                while len(self.sessions) > self.limit:
+                    self.sessions.popitem(last=False)
+            session.used = time.monotonic()
+            self.sessions.move_to_end(user)
+            return session
+
+    def _expire(self):
+        now = time.monotonic()
+        while self.sessions:
+            user, session = next(iter(self.sessions.items()))
+            if now - session.used < self.ttl:
+                break
+            del self.sessions[user]
+
+_sessions = Sessions()
+
+## Returns the session of a user, starting one if needed. Users without an id (None) get a new,
+# unshared session every time
+def get_session(user) -> Session:
+    return Session() if user is None else _sessions.get(user)
+
+## Returns a user's session if they have one
+def peek_session(user) -> Session | None:
+    return None if user is None else _sessions.peek(user)
@@ -0,0 +1,285 @@
+import csv
+import json
+import os
+import re
+import sys
+import threading
+from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+
+from functions import SECONDS, get_seconds
+from terms import get_registry
+
+# Location of the scraped per-course csv files and of the ingested store of the data term
+CSV_DIR = get_registry().data_term.csv_dir
+STORE_DIR = get_registry().data_term.store_dir
+
+# Columns stored for every snapshot, in csv order
+COLUMNS = ['enrolled', 'available', 'waitlisted', 'total']
+SECONDS_DTYPE = np.int64
+COLUMN_DTYPE = np.int32
+
+INDEX_FILE = 'index.json'
+
+## A zero-copy view of one course's snapshots, one numpy array per column
+class CourseData(NamedTuple):
+    seconds: np.ndarray
+    enrolled: np.ndarray
+    available: np.ndarray
+    waitlisted: np.ndarray
+    total: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.seconds)
+
+    ## Converts the view back into the list of dicts returned by readcsv
+    def records(self) -> list[dict]:
+        columns = [self.seconds.tolist()] + [getattr(self, column).tolist() for column in COLUMNS]
+        return [dict(zip(['seconds'] + COLUMNS, row)) for row in zip(*columns)]
+
+    ## Returns the vertices of the line through every snapshot, which are the snapshots themselves
+    def polyline(self) -> 'CourseData':
+        return self
+
+## Change points of one course: run k covers the identical snapshots from start[k] through end[k].
+# Memory and scans scale with the number of changes rather than with how often the csv was
+# scraped. A run also starts at the first snapshot at or after each enrollment boundary in
+# SECONDS, so which snapshot a boundary falls on is still known without the raw snapshots.
+class Steps(NamedTuple):
+    start: np.ndarray
+    end: np.ndarray
+    enrolled: np.ndarray
+    available: np.ndarray
+    waitlisted: np.ndarray
+    total: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def _row(self, run: int) -> dict:
+        return {column: int(getattr(self, column)[run]) for column in COLUMNS}
+
+    ## Returns the values of the last snapshot at or before t, or None if t is before the first one
+    def at(self, t: float) -> dict | None:
+        run = int(np.searchsorted(self.start, t, side='right')) - 1
+        return None if run < 0 else self._row(run)
+
+    ## Looks up the first snapshot at or after t, like analysis.pass_index.
+    # Returns (run, interior, row), where interior is True when that snapshot is not the first of
+    # its run, or None if t is not after the first snapshot or is after the last one
+    def state_at(self, t: float) -> tuple[int, bool, dict] | None:
+        if len(self.start) == 0 or t <= self.start[0]:
+            return None
+        run = int(np.searchsorted(self.end, t, side='left'))
+        if run == len(self.end):
+            return None
+        return run, bool(self.start[run] < t), self._row(run)
+
+    ## Returns the change points as the list of dicts returned by readcsv
+    def records(self) -> list[dict]:
+        columns = [self.start.tolist()] + [getattr(self, column).tolist() for column in COLUMNS]
+        return [dict(zip(['seconds'] + COLUMNS, row)) for row in zip(*columns)]
+
+    ## Returns the vertices of the line through every snapshot: each run's first and last snapshot
+    def polyline(self) -> CourseData:
+        seconds = np.column_stack((self.start, self.end)).ravel()
+        return CourseData(seconds, *(np.repeat(getattr(self, column), 2) for column in COLUMNS))
+
+## Collapses consecutive identical snapshots into runs. boundaries are the enrollment times of the
+# data's term
+def to_steps(data: CourseData, boundaries: list = SECONDS) -> Steps:
+    if len(data) == 0:
+        return Steps(*(np.zeros(0, dtype=SECONDS_DTYPE if field in ('start', 'end') else COLUMN_DTYPE) for field in Steps._fields))
+    seconds = np.asarray(data.seconds)
+    values = [np.asarray(getattr(data, column)) for column in COLUMNS]
+    changed = np.zeros(len(data) - 1, dtype=bool)
+    for column in values:
+        changed |= column[1:] != column[:-1]
+    # a run also starts at the first snapshot at or after each boundary
+    firsts = np.searchsorted(seconds, boundaries, side='left')
+    changed[firsts[(firsts >= 1) & (firsts < len(data))] - 1] = True
+    starts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+    ends = np.concatenate((starts[1:] - 1, [len(data) - 1]))
+    return Steps(seconds[starts], seconds[ends], *(column[starts] for column in values))
+
+## Parses csv rows into column lists, using the same format rules as readcsv
+def parse_rows(lines) -> tuple[list[int], list[list[int]]]:
+    seconds = []
+    columns = [[] for _ in COLUMNS]
+    reader = csv.reader(lines, delimiter=' ', quotechar='|')
+    for line in reader:
+        tokenized = line[0].split(',')
+        date = [int(num) for num in re.findall(r'\d+', tokenized[0])]
+        seconds.append(int(get_seconds(datetime(*date))))
+        for column, value in zip(columns, tokenized[1:5]):
+            column.append(int(value))
+    return seconds, columns
+
+## Parses a single course csv from byte offset on, ignoring a trailing line that is still being written
+# Returns (seconds, columns, offset just past the last complete line)
+def parse_csv(filepath: str, offset: int = 0) -> tuple[list[int], list[list[int]], int]:
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        chunk = f.read()
+    complete = chunk.rfind(b'\n') + 1
+    lines = chunk[:complete].decode().splitlines()
+    if offset == 0:
+        # Skip formatting line
+        lines = lines[1:]
+    seconds, columns = parse_rows(lines)
+    return seconds, columns, offset + complete
+
+## Converts every csv in csv_dir into one columnar store in store_dir.
+# The store consists of one .npy file per column holding every course back to back,
+# and an index file with the [start, stop) offsets of each course.
+# Returns the number of courses ingested
+def ingest(csv_dir: str = CSV_DIR, store_dir: str = STORE_DIR) -> int:
+    names = sorted(f[:-4] for f in os.listdir(csv_dir) if f.endswith('.csv'))
+
+    seconds = []
+    columns = [[] for _ in COLUMNS]
+    offsets = {}
+    sizes = {}
+    for course in names:
+        course_seconds, course_columns, sizes[course] = parse_csv(os.path.join(csv_dir, f'{course}.csv'))
+        offsets[course] = [len(seconds), len(seconds) + len(course_seconds)]
+        seconds.extend(course_seconds)
+        for column, values in zip(columns, course_columns):
+            column.extend(values)
+
+    os.makedirs(store_dir, exist_ok=True)
+    _write_array(store_dir, 'seconds', np.array(seconds, dtype=SECONDS_DTYPE))
+    for name, values in zip(COLUMNS, columns):
+        _write_array(store_dir, name, np.array(values, dtype=COLUMN_DTYPE))
+
+    # The index is written last so a reader never sees offsets for arrays that are not there yet
+    versions = {course: int(os.path.getmtime(os.path.join(csv_dir, f'{course}.csv'))) for course in names}
+    index = {
+        'version': max(versions.values(), default=0),
+        'rows': len(seconds),
+        'courses': offsets,
+        'versions': versions,
+        'sizes': sizes
+    }
+    _write_json(os.path.join(store_dir, INDEX_FILE), index)
+    return len(names)
+
+def _write_array(store_dir: str, name: str, array: np.ndarray):
+    path = os.path.join(store_dir, f'{name}.npy')
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(path + '.tmp', path)
+
+def _write_json(path: str, data):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+## Growable copy of one course's snapshots, holding rows appended after ingestion.
+# Capacity doubles as rows arrive, so appending costs amortized O(new rows).
+class Overlay:
+    def __init__(self, data: CourseData, extra: int = 0):
+        capacity = max(1024, 2 * (len(data) + extra))
+        self.length = len(data)
+        self.arrays = []
+        for column in CourseData._fields:
+            array = np.empty(capacity, dtype=SECONDS_DTYPE if column == 'seconds' else COLUMN_DTYPE)
+            array[:self.length] = getattr(data, column)
+            self.arrays.append(array)
+
+    def extend(self, seconds: list[int], columns: list[list[int]]):
+        needed = self.length + len(seconds)
+        if needed > len(self.arrays[0]):
+            grown = []
+            for array in self.arrays:
+                larger = np.empty(2 * needed, dtype=array.dtype)
+                larger[:self.length] = array[:self.length]
+                grown.append(larger)
+            self.arrays = grown
+        for array, values in zip(self.arrays, [seconds] + columns):
+            array[self.length:needed] = values
+        self.length = needed
+
+    ## Returns views of the current rows. Later appends never modify rows already returned
+    def view(self) -> CourseData:
+        return CourseData(*(array[:self.length] for array in self.arrays))
+
+## Memory-mapped view over an ingested store. Rows appended later (see watcher.py) are kept in
+# per-course in-memory overlays on top of the read-only mapped arrays.
+class CourseStore:
+    def __init__(self, store_dir: str = STORE_DIR):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.version = index['version']
+        self.offsets = index['courses']
+        self.versions = index['versions']
+        # byte offset in each course csv up to which rows are in the store
+        self.sizes = index['sizes']
+        self.overlays = {}
+        self.seconds = np.load(os.path.join(store_dir, 'seconds.npy'), mmap_mode='r')
+        self.columns = {name: np.load(os.path.join(store_dir, f'{name}.npy'), mmap_mode='r') for name in COLUMNS}
+
+    def __contains__(self, course: str) -> bool:
+        return course in self.offsets or course in self.overlays
+
+    def __len__(self) -> int:
+        return len(self.courses())
+
+    def courses(self) -> list[str]:
+        return list(self.offsets) + [course for course in self.overlays if course not in self.offsets]
+
+    ## Returns whether a course has rows that are only in memory, not in the mapped files
+    def is_modified(self, course: str) -> bool:
+        return course in self.overlays
+
+    ## Returns the data version of a course (modification time of its csv when ingested)
+    def version_of(self, course: str) -> int:
+        return self.versions.get(course, 0)
+
+    ## Returns the snapshots of a course as slices of the mapped arrays, or None if unknown
+    def get(self, course: str) -> CourseData | None:
+        if course in self.overlays:
+            return self.overlays[course].view()
+        if course not in self.offsets:
+            return None
+        start, stop = self.offsets[course]
+        return CourseData(self.seconds[start:stop], *(self.columns[name][start:stop] for name in COLUMNS))
+
+    ## Appends rows parsed from a course csv up to byte offset size. Unknown courses are added.
+    # With replace, the rows replace everything stored for the course (the csv was rewritten)
+    def append(self, course: str, seconds: list[int], columns: list[list[int]], size: int, version: int, replace: bool = False):
+        if replace or course not in self:
+            empty = CourseData(*(np.zeros(0, dtype=COLUMN_DTYPE) for _ in CourseData._fields))
+            self.overlays[course] = Overlay(empty, len(seconds))
+        elif course not in self.overlays:
+            self.overlays[course] = Overlay(self.get(course), len(seconds))
+        self.overlays[course].extend(seconds, columns)
+        self.sizes[course] = size
+        self.versions[course] = version
+
+# stores by term key, opened on first use
+_stores = {}
+# the store is loaded by the startup warm-up on a thread while queries may already need it
+_store_lock = threading.Lock()
+
+## Returns the process-wide store of a term (default: the data term), ingesting the term's csv
+# directory first if no store exists yet
+def get_store(term: str | None = None) -> CourseStore:
+    term = get_registry().get(term) if term else get_registry().data_term
+    with _store_lock:
+        if term.key not in _stores:
+            if not os.path.exists(os.path.join(term.store_dir, INDEX_FILE)):
+                if term.csv_dir is None:
+                    raise FileNotFoundError(f'Term {term.key} has no store in {term.store_dir} and no csv directory to ingest')
+                ingest(term.csv_dir, term.store_dir)
+            _stores[term.key] = CourseStore(term.store_dir)
+    return _stores[term.key]
+
+if __name__ == '__main__':
+    # Usage: python store.py [csv_dir] [store_dir]
+    csv_dir = sys.argv[1] if len(sys.argv) > 1 else CSV_DIR
+    store_dir = sys.argv[2] if len(sys.argv) > 2 else STORE_DIR
+    print(f'Ingested {ingest(csv_dir, store_dir)} courses into {store_dir}')
@@ -0,0 +1,225 @@
+import json
+import os
+import sys
+import threading
+from typing import NamedTuple
+
+import numpy as np
+
+from analysis import build_overview, capacity_index, step_passes, waitlist_flow
+from functions import SECONDS, TIMES_TO_STR, new_to_old, old_to_new
+from store import STORE_DIR, COLUMNS, SECONDS_DTYPE, CourseData, CourseStore, Steps, get_store, to_steps
+from terms import get_registry
+
+## Precomputed per-course facts, so overviews never have to scan raw snapshots.
+# For every course the index keeps the capacity-crossing time, the state at each TIMES_TO_STR
+# boundary, the waitlist totals, and the course's change points (store.Steps), which store one
+# entry per run of identical snapshots instead of one per snapshot.
+
+SUMMARY_ARRAYS = 'summary.npz'
+SUMMARY_FILE = 'summary.json'
+# Bumped whenever the layout of the summary files changes, so older ones are rebuilt
+SUMMARY_FORMAT = 2
+
+## The precomputed facts for one course
+class CourseSummary(NamedTuple):
+    capacity_seconds: int | None
+    # state at each TIMES_TO_STR boundary, None where the boundary is outside the recorded range
+    periods: list
+    max_waitlist: int
+    joined: int
+    left: int
+    steps: Steps
+
+## Computes the summary of one course. boundaries are the enrollment times of the course's term
+def summarize(data: CourseData, boundaries: list = SECONDS) -> CourseSummary:
+    steps = to_steps(data, boundaries)
+    capacity = capacity_index(data.enrolled, data.total)
+    periods = []
+    for boundary in boundaries[:len(TIMES_TO_STR)]:
+        state = steps.state_at(boundary)
+        periods.append(None if state is None else state[2])
+    max_waitlist, joined, left = waitlist_flow(data.waitlisted)
+    return CourseSummary(None if capacity < 0 else int(data.seconds[capacity]), periods, max_waitlist, joined, left, steps)
+
+## Returns the summary after appending the snapshots in new, without rescanning the old snapshots
+def extend_summary(summary: CourseSummary, new: CourseData, boundaries: list = SECONDS) -> CourseSummary:
+    steps = summary.steps
+    if len(new) == 0:
+        return summary
+    if len(steps.start) == 0:
+        return summarize(new, boundaries)
+
+    # prefix the new rows with the last known snapshot so changes across the boundary are seen
+    joined = CourseData(np.concatenate((steps.end[-1:], new.seconds)),
+                        *(np.concatenate((getattr(steps, column)[-1:], getattr(new, column))) for column in COLUMNS))
+
+    capacity_seconds = summary.capacity_seconds
+    if capacity_seconds is None:
+        capacity = capacity_index(joined.enrolled, joined.total)
+        capacity_seconds = None if capacity < 0 else int(joined.seconds[capacity])
+    max_waitlist, joined_waitlist, left_waitlist = waitlist_flow(joined.waitlisted)
+
+    # the first new run continues the last known run
+    added = to_steps(joined, boundaries)
+    steps = Steps(np.concatenate((steps.start, added.start[1:])),
+                  np.concatenate((steps.end[:-1], added.end)),
+                  *(np.concatenate((getattr(steps, column), getattr(added, column)[1:])) for column in COLUMNS))
+
+    periods = list(summary.periods)
+    for period, boundary in enumerate(boundaries[:len(TIMES_TO_STR)]):
+        if periods[period] is None:
+            state = steps.state_at(boundary)
+            periods[period] = None if state is None else state[2]
+
+    return CourseSummary(capacity_seconds, periods, max(summary.max_waitlist, max_waitlist),
+                         summary.joined + joined_waitlist, summary.left + left_waitlist, steps)
+
+## Builds the summary index for every course in the store and writes it next to the store.
+# Returns the number of courses summarized
+def build(store: CourseStore, store_dir: str = STORE_DIR, boundaries: list = SECONDS) -> int:
+    facts = {}
+    steps = {name: [] for name in Steps._fields}
+    offsets = {}
+    rows = 0
+    for course in store.courses():
+        summary = summarize(store.get(course), boundaries)
+        facts[course] = {
+            'capacity': summary.capacity_seconds,
+            'periods': summary.periods,
+            'max_waitlist': summary.max_waitlist,
+            'joined': summary.joined,
+            'left': summary.left
+        }
+        offsets[course] = [rows, rows + len(summary.steps.start)]
+        rows += len(summary.steps.start)
+        for name in Steps._fields:
+            steps[name].append(getattr(summary.steps, name))
+
+    arrays = {name: np.concatenate(parts) if parts else np.zeros(0) for name, parts in steps.items()}
+    path = os.path.join(store_dir, SUMMARY_ARRAYS)
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(path + '.tmp', path)
+
+    # Written last, like the store index
+    path = os.path.join(store_dir, SUMMARY_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'format': SUMMARY_FORMAT, 'version': store.version, 'courses': facts, 'offsets': offsets}, f)
+    os.replace(path + '.tmp', path)
+    return len(facts)
+
+## Returns the department of a course name, such as 'CSE' for 'CSE 12A'
+def department_of(course: str) -> str:
+    return course.split(' ')[0]
+
+## Courses sorted by the time they first became full, shifted to this year's enrollment times
+# with old_to_new, for range queries over the whole catalog. Kept per department as well
+class CapacityIndex:
+    def __init__(self, capacities: dict):
+        ordered = sorted((old_to_new(seconds), course) for course, seconds in capacities.items() if seconds is not None)
+        self.seconds = np.array([seconds for seconds, _ in ordered], dtype=SECONDS_DTYPE)
+        self.courses = [course for _, course in ordered]
+        # department -> (seconds, courses), in the same order
+        self.departments = {}
+        for seconds, course in ordered:
+            times, courses = self.departments.setdefault(department_of(course), ([], []))
+            times.append(seconds)
+            courses.append(course)
+        self.departments = {department: (np.array(times, dtype=SECONDS_DTYPE), courses)
+                            for department, (times, courses) in self.departments.items()}
+
+    ## Returns (course, fill time) of every course that became full after start and at or before
+    # stop, earliest first. department limits the courses to one department, such as 'CSE'
+    def filled_between(self, start: float | None, stop: float, department: str | None = None) -> list[tuple[str, int]]:
+        if department is None:
+            seconds, courses = self.seconds, self.courses
+        else:
+            seconds, courses = self.departments.get(department.strip().upper(), (np.zeros(0, dtype=SECONDS_DTYPE), []))
+        first = 0 if start is None else int(np.searchsorted(seconds, start, side='right'))
+        last = int(np.searchsorted(seconds, stop, side='right'))
+        return [(courses[i], int(seconds[i])) for i in range(first, last)]
+
+## The loaded summary index
+class SummaryIndex:
+    def __init__(self, store: CourseStore, store_dir: str = STORE_DIR):
+        self.store = store
+        with open(os.path.join(store_dir, SUMMARY_FILE)) as f:
+            index = json.load(f)
+        self.format = index.get('format', 1)
+        self.version = index['version']
+        self.facts = index['courses']
+        self.offsets = index['offsets']
+        with np.load(os.path.join(store_dir, SUMMARY_ARRAYS)) as arrays:
+            self.arrays = {name: arrays[name] for name in Steps._fields}
+
+        # summaries changed since the index was built, kept in memory
+        self.updated = {}
+        # built on first use, and again after any summary changes
+        self.capacities = None
+
+    def __contains__(self, course: str) -> bool:
+        return course in self.facts or course in self.updated
+
+    ## Updates a course's summary with newly appended snapshots
+    def extend(self, course: str, new: CourseData):
+        summary = self.get(course)
+        self.updated[course] = summarize(new) if summary is None else extend_summary(summary, new)
+        self.capacities = None
+
+    ## Replaces a course's summary, computed from all of its snapshots
+    def reset(self, course: str, data: CourseData):
+        self.updated[course] = summarize(data)
+        self.capacities = None
+
+    ## Returns the capacity index over every course
+    def capacity_index(self) -> CapacityIndex:
+        if self.capacities is None:
+            capacities = {course: facts['capacity'] for course, facts in self.facts.items()}
+            capacities.update({course: summary.capacity_seconds for course, summary in self.updated.items()})
+            self.capacities = CapacityIndex(capacities)
+        return self.capacities
+
+    ## Returns the summary of a course, or None if unknown
+    def get(self, course: str) -> CourseSummary | None:
+        if course in self.updated:
+            return self.updated[course]
+        if course not in self.facts:
+            return None
+        facts = self.facts[course]
+        start, stop = self.offsets[course]
+        steps = Steps(*(self.arrays[name][start:stop] for name in Steps._fields))
+        return CourseSummary(facts['capacity'], facts['periods'], facts['max_waitlist'], facts['joined'], facts['left'], steps)
+
+    ## Summarizes a course and returns an overview embed with additional recommendations
+    # Same result as analysis.get_overview, using O(log n) lookups into the change points
+    def overview(self, course: str, enrollment_times: tuple) -> dict:
+        summary = self.get(course)
+        times = [new_to_old(enrollment_times[0]), new_to_old(enrollment_times[1])]
+        # the snapshot times in the store tell apart two pass times inside the same run
+        passes = step_passes(summary.steps, times, self.store.get(course).seconds)
+        return build_overview(course, enrollment_times, passes, summary.capacity_seconds)
+
+# summary indexes by term key, loaded on first use
+_indexes = {}
+_index_lock = threading.Lock()
+
+## Returns the process-wide summary index of a term (default: the data term), rebuilding it when it
+# is missing, older than the store or in an older format
+def get_summary_index(term: str | None = None) -> SummaryIndex:
+    term = get_registry().get(term) if term else get_registry().data_term
+    with _index_lock:
+        if term.key not in _indexes:
+            store = get_store(term.key)
+            path = os.path.join(store.store_dir, SUMMARY_FILE)
+            index = SummaryIndex(store, store.store_dir) if os.path.exists(path) else None
+            if index is None or index.format != SUMMARY_FORMAT or index.version != store.version:
+                build(store, store.store_dir, term.seconds)
+                index = SummaryIndex(store, store.store_dir)
+            _indexes[term.key] = index
+    return _indexes[term.key]
+
+if __name__ == '__main__':
+    # Usage: python summary.py [store_dir]
+    store_dir = sys.argv[1] if len(sys.argv) > 1 else STORE_DIR
+    print(f'Summarized {build(CourseStore(store_dir), store_dir)} courses into {store_dir}')
@@ -0,0 +1,96 @@
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+## Registry of the enrollment terms the bot knows about, loaded from terms.json:
+#   {
+#       current: str                 (term whose pass times users enter)
+#       terms: {
+#           <key>: {
+#               name: str
+#               times: List[str]     (one 'YYYY-MM-DD HH:MM' per TIMES_TO_STR boundary, in order)
+#               csv: str             (optional, directory of the term's scraped csv files)
+#               store: str           (optional, directory of the term's ingested store)
+#               data: str            (optional, key of the term whose enrollment predicts this one;
+#                                     defaults to the term itself when it has data)
+#           }
+#       }
+#   }
+# Each term's boundaries are parsed once into a numpy array of seconds. A term's store and summaries
+# are only opened when first asked for (store.get_store, summary.get_summary_index), so listing old
+# terms here costs nothing until they are charted. Times in one term are carried over to another by
+# the offset between their first pass times.
+
+TERMS_FILE = 'terms.json'
+EPOCH = datetime(1970, 1, 1)
+# Boundaries every term lists, one per TIMES_TO_STR label
+BOUNDARIES = 11
+
+## One term's pass schedule and data location
+class Term:
+    def __init__(self, key: str, spec: dict):
+        self.key = key
+        self.name = spec.get('name', key)
+        self.times = [datetime.strptime(t, '%Y-%m-%d %H:%M') for t in spec['times']]
+        if len(self.times) != BOUNDARIES or self.times != sorted(self.times):
+            raise ValueError(f'Term {key} must list {BOUNDARIES} times in order, got {spec["times"]}')
+        self.seconds = np.array([(t - EPOCH).total_seconds() for t in self.times])
+        self.csv_dir = spec.get('csv')
+        self.store_dir = spec.get('store')
+        data = spec.get('data', key if self.store_dir else None)
+        self.data = data and data.upper()
+
+    def __repr__(self) -> str:
+        return f'Term({self.key!r})'
+
+    ## Returns whether enrollment data of this term is on disk or can be ingested
+    def has_data(self) -> bool:
+        return self.store_dir is not None
+
+    ## Returns t, a time in this term, moved to the same point of another term's schedule
+    def convert(self, t: float, other: 'Term') -> float:
+        return t + (other.seconds[0] - self.seconds[0])
+
+class Registry:
+    def __init__(self, spec: dict):
+        self.terms = {key.upper(): Term(key.upper(), term) for key, term in spec['terms'].items()}
+        self.current = self.get(spec['current'])
+        for term in self.terms.values():
+            if term.data is not None and not self.get(term.data).has_data():
+                raise ValueError(f'Term {term.key} takes its data from {term.data}, which has no store')
+        if self.current.data is None:
+            raise ValueError(f'The current term {self.current.key} has no data to predict it with')
+
+    def __contains__(self, key: str) -> bool:
+        return key.upper() in self.terms
+
+    ## Returns the term with the given key (case-insensitive)
+    def get(self, key: str) -> Term:
+        if key.upper() not in self.terms:
+            raise KeyError(f'Unknown term {key!r}, expected one of {", ".join(self.terms)}')
+        return self.terms[key.upper()]
+
+    ## Returns the term whose enrollment data predicts the current term
+    @property
+    def data_term(self) -> Term:
+        return self.get(self.current.data)
+
+    ## Returns every term with enrollment data, oldest first
+    def with_data(self) -> list[Term]:
+        return sorted((term for term in self.terms.values() if term.has_data()), key=lambda term: term.seconds[0])
+
+## Reads the registry from a terms file
+def load(path: str = TERMS_FILE) -> Registry:
+    with open(os.path.join(os.getcwd(), path)) as f:
+        return Registry(json.load(f))
+
+_registry = None
+
+## Returns the process-wide registry, read on first use
+def get_registry() -> Registry:
+    global _registry
+    if _registry is None:
+        _registry = load(TERMS_FILE)
+    return _registry
@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pytest
+
+import analysis
+import functions
+from benchmark import generate
+from functions import SECONDS_NEW, readcsv
+from store import COLUMN_DTYPE, SECONDS_DTYPE, CourseData, CourseStore, ingest, parse_csv, to_steps
+from summary import SummaryIndex, build
+
+## Checks that the array engine (analysis.py) and the summary index give the same overviews and
+# info embeds as the loop implementation in functions.py.
+# Run with: python -m pytest test_analysis.py
+
+# pass times on, just before, just after and between every enrollment milestone
+PASS_TIMES = sorted(set(SECONDS_NEW) | {t + offset for t in SECONDS_NEW for offset in (-3600, 1, 43200)})
+
+## Writes a course csv by hand: rows of (datetime, enrolled, available, waitlisted, total)
+def write_csv(directory: str, course: str, rows: list):
+    with open(os.path.join(directory, f'{course}.csv'), 'w') as f:
+        f.write('time,enrolled,available,waitlisted,total\n')
+        for date, *values in rows:
+            f.write(f'|{date:%Y-%m-%d %H:%M:%S}|,' + ','.join(map(str, values)) + '\n')
+
+@pytest.fixture(scope='module')
+def data_dir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('enrollment')
+    csv_dir = str(directory / 'csv')
+    courses = generate(csv_dir, 6, 60, seed=1)
+    # edge cases the simulation does not produce: a single snapshot, a course full from the start
+    # and one whose data ends before the passes
+    first = functions.TIMES[0]
+    write_csv(csv_dir, 'TEST 1', [(first, 5, 5, 0, 10)])
+    write_csv(csv_dir, 'TEST 2', [(first.replace(day=1), 20, 0, 3, 20), (first, 20, 0, 5, 20), (functions.TIMES[5], 20, 0, 1, 20)])
+    write_csv(csv_dir, 'TEST 3', [(first.replace(day=1), 0, 30, 0, 30), (first.replace(day=2), 29, 1, 0, 30)])
+    # long waitlists, across the 10% and 15% waitlist rules
+    times = functions.TIMES
+    write_csv(csv_dir, 'TEST 4', [(times[0], 5, 5, 0, 10), (times[1], 10, 0, 70, 10), (times[4], 10, 0, 80, 10),
+                                  (times[5], 10, 0, 120, 10), (times[6], 10, 0, 40, 10), (times[8], 10, 0, 0, 10)])
+    courses += ['TEST 1', 'TEST 2', 'TEST 3', 'TEST 4']
+
+    store_dir = str(directory / 'store')
+    ingest(csv_dir, store_dir)
+    store = CourseStore(store_dir)
+    build(store, store_dir)
+    return csv_dir, courses, store, SummaryIndex(store, store_dir)
+
+def course_data(csv_dir: str, course: str) -> tuple[list, CourseData]:
+    filepath = os.path.join(csv_dir, f'{course}.csv')
+    seconds, columns, _ = parse_csv(filepath)
+    data = CourseData(np.array(seconds, dtype=SECONDS_DTYPE), *(np.array(c, dtype=COLUMN_DTYPE) for c in columns))
+    return readcsv(filepath), data
+
+def comparable(overview: dict) -> tuple:
+    return overview['rec'], overview['wl_rec'], overview['embed'].to_dict()
+
+def test_overview_matches_loop(data_dir):
+    csv_dir, courses, store, index = data_dir
+    for course in courses:
+        records, data = course_data(csv_dir, course)
+        steps = to_steps(data)
+        for fp_time in PASS_TIMES:
+            for sp_time in PASS_TIMES:
+                times = (fp_time, sp_time)
+                expected = comparable(functions.get_overview(records, course, times))
+                assert comparable(analysis.get_overview(data, course, times)) == expected, (course, times)
+                assert comparable(analysis.get_overview(steps, course, times, data.seconds)) == expected, (course, times)
+                assert comparable(index.overview(course, times)) == expected, (course, times)
+
+def test_info_matches_loop(data_dir):
+    csv_dir, courses, store, index = data_dir
+    for course in courses:
+        records, data = course_data(csv_dir, course)
+        for standing in range(4):
+            expected = functions.get_info(records, course, standing).to_dict()
+            assert analysis.get_info(data, course, standing).to_dict() == expected, (course, standing)
+            assert analysis.get_info(to_steps(data), course, standing).to_dict() == expected, (course, standing)
+            assert analysis.get_info(index.get(course).steps, course, standing).to_dict() == expected, (course, standing)
+
+def test_store_matches_csv(data_dir):
+    csv_dir, courses, store, index = data_dir
+    for course in courses:
+        records, _ = course_data(csv_dir, course)
+        assert store.get(course).records() == records, course
@@ -0,0 +1,287 @@
+import asyncio
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from contextlib import contextmanager
+
+## Lightweight latency tracing for the /query pipeline.
+# stage() times a block of work, optionally for one course, and records its wall time and the net
+# number of memory blocks it allocated (sys.getallocatedblocks; process wide, so approximate while
+# other tasks run). interaction() wraps one user interaction, collects the stages inside it, and
+# can sample the event loop's stacks and keep them when the interaction turns out to be slow.
+# Every chart encoded is recorded with its format, size and encode time (encoded()), to weigh upload
+# bytes against encoding latency.
+# Startup milestones (bot ready, warm-up done, first interaction) are logged once as JSON lines,
+# in seconds since this module was imported, which main.py does first.
+# Rolling percentiles are exposed as Prometheus text and/or a periodic JSON log line, set with the
+# optional config keys
+#   metrics_port: int             (serve /metrics on 127.0.0.1, default off)
+#   metrics_log_interval: int     (seconds between JSON log lines, default off)
+#   slow_interaction_ms: int      (log the stage breakdown of slower interactions, default 2000)
+#   profile_slow: bool            (also save sampled stacks of slow interactions, default off)
+#   profile_interval_ms: int      (sampling period, default 5)
+#   profile_dir: str              (default '../profiles')
+
+WINDOW = 1024
+QUANTILES = [0.5, 0.95, 0.99]
+
+SLOW_INTERACTION_MS = 2000
+PROFILE_INTERVAL_MS = 5
+PROFILE_DIR = '../profiles'
+
+# As close to process start as tracing gets
+STARTED = time.perf_counter()
+
+## Rolling window of recent samples, plus lifetime count and sum
+class Histogram:
+    def __init__(self, window: int = WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    ## Returns the value at each quantile over the current window
+    def quantiles(self, quantiles: list[float] = QUANTILES) -> list:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return [0 for _ in quantiles]
+        return [ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in quantiles]
+
+## The stages recorded during one interaction
+class Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.time()
+        self.stages = []
+
+_lock = threading.Lock()
+# (stage, course) -> Histogram
+_seconds = {}
+_blocks = {}
+_current = contextvars.ContextVar('trace', default=None)
+# (format, scale) -> Histogram of encoded chart bytes / encode seconds
+_encoded_bytes = {}
+_encode_seconds = {}
+
+_config = {
+    'slow_interaction_ms': SLOW_INTERACTION_MS,
+    'profile_slow': False,
+    'profile_interval_ms': PROFILE_INTERVAL_MS,
+    'profile_dir': PROFILE_DIR
+}
+_started = False
+# milestone -> seconds since STARTED
+_milestones = {}
+
+def configure(config: dict):
+    for key in _config:
+        if key in config:
+            _config[key] = config[key]
+    _config['metrics_port'] = config.get('metrics_port')
+    _config['metrics_log_interval'] = config.get('metrics_log_interval')
+
+def record(name: str, course: str | None, seconds: float, blocks: int):
+    key = (name, course or '')
+    with _lock:
+        if key not in _seconds:
+            _seconds[key] = Histogram()
+            _blocks[key] = Histogram()
+        _seconds[key].add(seconds)
+        _blocks[key].add(blocks)
+
+## Records one encoded chart: its format, the scale it was shrunk to, its size in bytes and the
+# seconds spent encoding it (every attempt included)
+def encoded(format: str, scale: float, size: int, seconds: float):
+    key = (format, f'{scale:g}')
+    with _lock:
+        if key not in _encoded_bytes:
+            _encoded_bytes[key] = Histogram()
+            _encode_seconds[key] = Histogram()
+        _encoded_bytes[key].add(size)
+        _encode_seconds[key].add(seconds)
+
+## Times the enclosed block as one pipeline stage
+@contextmanager
+def stage(name: str, course: str | None = None):
+    began = time.perf_counter()
+    blocks = sys.getallocatedblocks()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - began
+        allocated = sys.getallocatedblocks() - blocks
+        record(name, None, elapsed, allocated)
+        if course:
+            record(name, course, elapsed, allocated)
+        trace = _current.get()
+        if trace is not None:
+            trace.stages.append((name, course, elapsed, allocated))
+
+## Records the first time a startup milestone is reached and logs it
+def milestone(name: str, **details):
+    with _lock:
+        if name in _milestones:
+            return
+        _milestones[name] = time.perf_counter() - STARTED
+    print(json.dumps({'event': 'startup', 'milestone': name, 'seconds': _milestones[name], **details}))
+
+## Samples the stacks of one thread until stopped, counting identical stacks
+class Sampler(threading.Thread):
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name='trace-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            self.stacks[';'.join(f'{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})' for entry in stack)] += 1
+
+    def stop(self):
+        self.stopped.set()
+
+    ## Writes the samples in collapsed-stack format (one "frame;frame;frame count" line per stack)
+    def dump(self, path: str):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+## Traces one user interaction: its total time, every stage inside it, and, if enabled, sampled
+# stacks that are kept when it is slower than slow_interaction_ms. Samples cover the whole event
+# loop thread, so concurrent interactions show up in each other's profiles.
+@contextmanager
+def interaction(name: str):
+    trace = Trace(name)
+    token = _current.set(trace)
+    sampler = None
+    if _config['profile_slow']:
+        sampler = Sampler(threading.get_ident(), _config['profile_interval_ms'] / 1000)
+        sampler.start()
+    began = time.perf_counter()
+    try:
+        with stage(name):
+            yield trace
+    finally:
+        _current.reset(token)
+        elapsed = time.perf_counter() - began
+        if sampler is not None:
+            sampler.stop()
+        milestone('first_interaction', interaction=name, interaction_seconds=elapsed)
+        if elapsed * 1000 >= _config['slow_interaction_ms']:
+            line = {
+                'event': 'slow_interaction',
+                'name': name,
+                'started': trace.started,
+                'seconds': elapsed,
+                'stages': [{'stage': s, 'course': c, 'seconds': t, 'allocated_blocks': b} for s, c, t, b in trace.stages]
+            }
+            if sampler is not None:
+                os.makedirs(_config['profile_dir'], exist_ok=True)
+                line['profile'] = os.path.join(_config['profile_dir'], f'{int(trace.started * 1000)}-{name}.txt')
+                sampler.dump(line['profile'])
+            print(json.dumps(line))
+
+def _labels(key: tuple, **extra) -> str:
+    name, course = key
+    labels = {'stage': name}
+    if course:
+        labels['course'] = course
+    labels.update(extra)
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+## Returns every histogram in the Prometheus text exposition format
+def prometheus() -> str:
+    lines = []
+    with _lock:
+        metrics = [
+            ('enrollment_stage_seconds', 'Wall time of each /query pipeline stage', _seconds),
+            ('enrollment_stage_allocated_blocks', 'Net memory blocks allocated by each /query pipeline stage', _blocks)
+        ]
+        for metric, description, histograms in metrics:
+            lines.append(f'# HELP {metric} {description}')
+            lines.append(f'# TYPE {metric} summary')
+            for key, histogram in sorted(histograms.items()):
+                for q, value in zip(QUANTILES, histogram.quantiles()):
+                    lines.append(f'{metric}{_labels(key, quantile=q)} {value}')
+                lines.append(f'{metric}_sum{_labels(key)} {histogram.total}')
+                lines.append(f'{metric}_count{_labels(key)} {histogram.count}')
+        metrics = [
+            ('enrollment_chart_bytes', 'Size of each encoded chart', _encoded_bytes),
+            ('enrollment_chart_encode_seconds', 'Time spent encoding each chart', _encode_seconds)
+        ]
+        for metric, description, histograms in metrics:
+            lines.append(f'# HELP {metric} {description}')
+            lines.append(f'# TYPE {metric} summary')
+            for (format, scale), histogram in sorted(histograms.items()):
+                labels = f'format="{_escape(format)}",scale="{scale}"'
+                for q, value in zip(QUANTILES, histogram.quantiles()):
+                    lines.append(f'{metric}{{{labels},quantile="{q}"}} {value}')
+                lines.append(f'{metric}_sum{{{labels}}} {histogram.total}')
+                lines.append(f'{metric}_count{{{labels}}} {histogram.count}')
+        lines.append('# HELP enrollment_startup_seconds Seconds from process start to each startup milestone')
+        lines.append('# TYPE enrollment_startup_seconds gauge')
+        for name, seconds in sorted(_milestones.items()):
+            lines.append(f'enrollment_startup_seconds{{milestone="{_escape(name)}"}} {seconds}')
+    return '\n'.join(lines) + '\n'
+
+## Returns per-stage percentiles across all courses, for the periodic log line
+def snapshot() -> dict:
+    stages = {}
+    with _lock:
+        for (name, course), histogram in _seconds.items():
+            if course:
+                continue
+            p50, p95, p99 = histogram.quantiles()
+            stages[name] = {'count': histogram.count, 'p50': p50, 'p95': p95, 'p99': p99}
+    return stages
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await reader.readline()
+        # drain the headers
+        while (await reader.readline()).strip():
+            pass
+        if request.split(b' ')[1:2] == [b'/metrics']:
+            body = prometheus().encode()
+            status = b'200 OK'
+        else:
+            body = b'not found\n'
+            status = b'404 Not Found'
+        writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: '
+                     + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def _log_periodically(interval: int):
+    while True:
+        await asyncio.sleep(interval)
+        print(json.dumps({'event': 'stage_latency', 'time': time.time(), 'stages': snapshot()}))
+
+## Starts the metrics endpoint and log task configured, once per process
+async def start():
+    global _started
+    if _started:
+        return
+    _started = True
+    if _config.get('metrics_port'):
+        await asyncio.start_server(_handle, '127.0.0.1', _config['metrics_port'])
+    if _config.get('metrics_log_interval'):
+        asyncio.ensure_future(_log_periodically(_config['metrics_log_interval']))
@@ -0,0 +1,55 @@
+import asyncio
+
+import charts
+import tracing
+from catalog import get_catalog
+from faq import get_faq
+from store import get_store
+from summary import get_summary_index
+
+## Startup warm-up, run in the background once the bot is connected so it never holds up the
+# gateway connection. Loads the course store, summaries and catalog on a thread, then primes the
+# render workers (matplotlib, fonts, Agg) and builds the backgrounds of the most requested
+# course charts. Coroutines that read the indexes await ready() first: loading them holds the
+# store and summary locks, and waiting for those on the event loop would stall the gateway
+# connection and every other interaction. Configured with the optional config key
+#   warmup_charts: int (course backgrounds to build, default 20; 0 only primes the workers)
+
+WARMUP_CHARTS = 20
+
+## Loads every index a query reads. Blocking, so it runs off the event loop
+def load_indexes():
+    get_store()
+    get_summary_index().capacity_index()
+    get_catalog()
+    get_faq()
+
+_loading = None
+
+## Waits until the indexes are loaded, loading them on a thread if nobody has started to yet.
+# A failed load is retried by the next caller
+async def ready():
+    global _loading
+    if _loading is None or (_loading.done() and _loading.exception() is not None):
+        _loading = asyncio.get_running_loop().run_in_executor(None, load_indexes)
+    # a cancelled caller must not cancel the load the others wait for
+    await asyncio.shield(_loading)
+
+async def run(charts_to_warm: int = WARMUP_CHARTS):
+    try:
+        with tracing.stage('warmup_indexes'):
+            await ready()
+        tracing.milestone('indexes_loaded')
+        with tracing.stage('warmup_charts'):
+            courses = await charts.warm_up(charts_to_warm)
+        tracing.milestone('warmed_up', charts=len(courses))
+    except Exception as e:
+        print(f'Warm-up failed: {e!r}')
+
+_task = None
+
+## Starts the warm-up in the background, once per process
+def start(config: dict):
+    global _task
+    if _task is None:
+        _task = asyncio.ensure_future(run(config.get('warmup_charts', WARMUP_CHARTS)))
@@ -0,0 +1,92 @@
+import asyncio
+import os
+
+import numpy as np
+
+import charts
+import tracing
+import warmup
+from store import CSV_DIR, COLUMN_DTYPE, SECONDS_DTYPE, CourseData, get_store, parse_csv
+from summary import get_summary_index
+
+## Incremental ingestion of live enrollment snapshots.
+# The scraper keeps appending rows to the course csvs while enrollment is open. The watcher polls
+# the data directory, reads each changed csv from the byte offset the store already covers, and
+# appends only the new rows to the store and the course summary, then drops that course's cached
+# charts. A csv that shrank was rewritten and is read again from the start. Configured with the
+# optional config key
+#   ingest_poll_interval: int (seconds between scans, default 30; 0 disables the watcher)
+
+POLL_INTERVAL = 30
+
+class Watcher:
+    def __init__(self, directory: str = CSV_DIR, interval: int = POLL_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+
+    ## Finds csvs with rows the store does not have yet and parses those rows.
+    # Only reads files, so it can run off the event loop.
+    # Returns a list of (course, seconds, columns, size, version, replace)
+    def collect(self) -> list[tuple]:
+        store = get_store()
+        updates = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.csv'):
+                continue
+            course = entry.name[:-4]
+            stat = entry.stat()
+            offset = store.sizes.get(course, 0)
+            if stat.st_size == offset:
+                continue
+            replace = stat.st_size < offset
+            seconds, columns, size = parse_csv(entry.path, 0 if replace else offset)
+            if size == offset and not replace:
+                # only a partial line so far
+                continue
+            updates.append((course, seconds, columns, size, stat.st_mtime_ns, replace))
+        return updates
+
+    ## Applies parsed rows to the store, the summaries and the chart cache
+    def apply(self, updates: list[tuple]):
+        store = get_store()
+        index = get_summary_index()
+        cache = charts.get_cache()
+        for course, seconds, columns, size, version, replace in updates:
+            with tracing.stage('ingest', course):
+                known = course in store
+                store.append(course, seconds, columns, size, version, replace=replace)
+                if replace or not known:
+                    index.reset(course, store.get(course))
+                else:
+                    new = CourseData(np.array(seconds, dtype=SECONDS_DTYPE), *(np.array(c, dtype=COLUMN_DTYPE) for c in columns))
+                    index.extend(course, new)
+                cache.invalidate(course)
+
+    ## Scans once. Returns the courses that changed
+    async def scan(self) -> list[str]:
+        # apply() reads the store and summaries on the event loop, so they must be loaded already
+        await warmup.ready()
+        loop = asyncio.get_running_loop()
+        updates = await loop.run_in_executor(None, self.collect)
+        self.apply(updates)
+        return [update[0] for update in updates]
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                changed = await self.scan()
+            except Exception as e:
+                print(f'Ingestion failed: {e!r}')
+                continue
+            if changed:
+                print(f'Ingested new snapshots for {len(changed)} courses')
+
+_task = None
+
+## Starts the watcher in the background, once per process
+def start(config: dict):
+    global _task
+    interval = config.get('ingest_poll_interval', POLL_INTERVAL)
+    if _task is None and interval:
+        _task = asyncio.ensure_future(Watcher(CSV_DIR, interval).run())